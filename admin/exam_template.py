@@ -5,15 +5,58 @@ Copyright 2024, Kansas Fiber Network, LLC
 """
 
 from dataclasses import dataclass, field
-from typing import List
+from typing import Callable, List, Optional
 from user import User
 from uuid import UUID
 
 import model
 
-from nicegui import ui
+from broadcast import exam_template_topic, get_broadcaster, Message
+from item_analysis import item_analyzer, ItemStatistics, QuestionStatistics
+from nicegui import context, ui
+from response_cache import exam_template_tag, response_cache
+from tortoise import timezone
+from tortoise.exceptions import DoesNotExist
 
-from serializable import Serializable
+from serializable import ConcurrentModificationError, save_versioned, Serializable
+
+# Editor components are keyed by entity and kept alive between edits, so an edit only
+# pushes the element it touched instead of re-rendering the whole question or template.
+
+# Every write is checked against the row's version and broadcast to the other editors of
+# the same template, who apply the change to their own component tree in place.
+
+
+async def publish_change(
+    exam_template_id: UUID, entity: str, op: str, id: UUID, version: int, **fields
+) -> None:
+    message: Message = {
+        "entity": entity,
+        "op": op,
+        "id": str(id),
+        "version": version,
+        "fields": fields,
+    }
+    response_cache.invalidate(exam_template_tag(exam_template_id))
+    # Correct answers and the question set decide how attempts are graded
+    if entity == "response" or (entity == "question" and op != "update"):
+        item_analyzer.forget([exam_template_id])
+    await get_broadcaster().publish(exam_template_topic(exam_template_id), message)
+
+
+def notify_conflict(entity: str) -> None:
+    ui.notify(
+        f"This {entity} was changed by another editor and has been reloaded",
+        type="warning",
+    )
+
+
+def notify_unsaved_conflict(entity: str) -> None:
+    ui.notify(
+        f"This {entity} was changed by another editor while you were editing it, "
+        "saving will overwrite their change",
+        type="warning",
+    )
 
 
 @dataclass
@@ -23,6 +66,13 @@ class ExamTemplateQuestionResponse(Serializable):
     exam_template_question_id: UUID
     value: str
     is_correct: bool
+    exam_template_id: Optional[UUID] = None
+    version: int = 1
+
+    _input: Optional[ui.input] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _row: Optional[ui.row] = field(default=None, init=False, repr=False, compare=False)
 
     async def new(self) -> None:
         exam_template_question_response = (
@@ -33,38 +83,116 @@ class ExamTemplateQuestionResponse(Serializable):
             )
         )
         self.id = exam_template_question_response.id
-        self.edit.refresh()
+        self.version = exam_template_question_response.version
+        self.is_correct = exam_template_question_response.is_correct
+        self.mark_saved()
+        await self.publish("create")
+
+    def values(self) -> dict[str, any]:
+        return {"value": self.value, "is_correct": self.is_correct}
 
     async def save(self) -> None:
-        exam_template_question_response = await model.ExamTemplateQuestionResponse.get(
-            id=self.id
-        )
-        exam_template_question_response.value = self.value
-        exam_template_question_response.is_correct = self.is_correct
-        await exam_template_question_response.save()
-        self.edit.refresh()
+        if not self.is_dirty():
+            return
+        try:
+            self.version = await save_versioned(
+                model.ExamTemplateQuestionResponse,
+                self.id,
+                self.version,
+                **self.values(),
+            )
+        except ConcurrentModificationError:
+            await self.reload()
+            notify_conflict("response")
+            return
+        self.mark_saved()
+        self.update_is_correct()
+        await self.publish("update")
+
+    async def reload(self) -> None:
+        try:
+            response = await model.ExamTemplateQuestionResponse.get(id=self.id)
+        except DoesNotExist:
+            return
+        self.value = response.value
+        self.is_correct = response.is_correct
+        self.version = response.version
+        self.mark_saved()
+        self.update_is_correct()
 
     async def delete(self) -> None:
         response = await model.ExamTemplateQuestionResponse.get(id=self.id)
         await response.delete()
+        await self.publish("delete")
+        self.remove_row()
         self.id = None
         self.exam_template_question_id = None
         self.value = None
 
+    async def publish(self, op: str) -> None:
+        await publish_change(
+            self.exam_template_id,
+            "response",
+            op,
+            self.id,
+            self.version,
+            exam_template_question_id=str(self.exam_template_question_id),
+            value=self.value,
+            is_correct=self.is_correct,
+        )
+
+    def apply(self, message: Message) -> None:
+        if self.apply_values(
+            message["version"],
+            {
+                "value": message["fields"]["value"],
+                "is_correct": message["fields"]["is_correct"],
+            },
+        ):
+            notify_unsaved_conflict("response")
+        self.update_is_correct()
+
     @staticmethod
     async def load(from_value: model.ExamTemplateQuestionResponse) -> any:
         return ExamTemplateQuestionResponse(
             id=from_value.id,
-            exam_template_question_id=from_value.id,
+            exam_template_question_id=from_value.exam_template_question_id,
             value=from_value.value,
             is_correct=from_value.is_correct,
+            version=from_value.version,
         )
 
-    @ui.refreshable
-    async def edit(self) -> None:
-        ui.input().on(type="blur", handler=self.save).bind_value(
-            self, "value"
-        ).tailwind.background_color("green-800" if self.is_correct else "")
+    def update_is_correct(self) -> None:
+        if self._input is not None:
+            if self.is_correct:
+                self._input.classes(add="bg-green-800")
+            else:
+                self._input.classes(remove="bg-green-800")
+
+    def remove_row(self) -> None:
+        if self._row is not None:
+            self._row.delete()
+            self._row = None
+            self._input = None
+
+    def edit(self, question: "ExamTemplateQuestion") -> ui.row:
+        with ui.row() as self._row:
+            self._input = (
+                ui.input().on(type="blur", handler=self.save).bind_value(self, "value")
+            )
+            self.update_is_correct()
+            selection_rate = question.selection_rate(self.id)
+            if selection_rate is not None:
+                ui.label(f"{selection_rate:.0%}").tooltip("Selected by")
+            ui.button(
+                on_click=lambda: question.toggle_response_correct(self),
+                icon="check",
+            )
+            ui.button(
+                on_click=lambda: question.delete_response(self),
+                icon="delete",
+            ).props("flat").classes("ml-auto")
+        return self._row
 
 
 @dataclass
@@ -75,6 +203,14 @@ class ExamTemplateQuestion(Serializable):
     type: model.QuestionType
     body: str
     responses: List[ExamTemplateQuestionResponse] = field(default_factory=lambda: [])
+    version: int = 1
+
+    _responses_column: Optional[ui.column] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _statistics: Optional[QuestionStatistics] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     async def new(self) -> None:
         exam_template_question = await model.ExamTemplateQuestion.create(
@@ -83,46 +219,120 @@ class ExamTemplateQuestion(Serializable):
             body=self.body,
         )
         self.id = exam_template_question.id
+        self.version = exam_template_question.version
+        self.mark_saved()
+        await self.publish("create")
         for response in self.responses:
             response.exam_template_question_id = self.id
-            response.new()
+            response.exam_template_id = self.exam_template_id
+            await response.new()
+
+    def values(self) -> dict[str, any]:
+        return {"type": self.type, "body": self.body}
 
     async def save(self) -> None:
-        question = await model.ExamTemplateQuestion.get(id=self.id)
-        question.type = self.type
-        question.body = self.body
-        await question.save()
-        for response in self.responses:
-            await response.save()
-        self.edit.refresh()
+        # Responses persist themselves on blur, only the question row is written here
+        if not self.is_dirty():
+            return
+        try:
+            self.version = await save_versioned(
+                model.ExamTemplateQuestion, self.id, self.version, **self.values()
+            )
+        except ConcurrentModificationError:
+            await self.reload()
+            notify_conflict("question")
+            return
+        self.mark_saved()
+        await self.publish("update")
+
+    async def reload(self) -> None:
+        try:
+            question = await model.ExamTemplateQuestion.get(id=self.id)
+        except DoesNotExist:
+            return
+        self.type = question.type
+        self.body = question.body
+        self.version = question.version
+        self.mark_saved()
 
     async def delete(self) -> None:
         for response in self.responses:
             await response.delete()
         question = await model.ExamTemplateQuestion.get(id=self.id)
         await question.delete()
+        await self.publish("delete")
         self.id = None
         self.exam_template_id = None
         self.type = None
         self.body = None
         self.responses.clear()
 
+    async def publish(self, op: str) -> None:
+        await publish_change(
+            self.exam_template_id,
+            "question",
+            op,
+            self.id,
+            self.version,
+            type=int(self.type),
+            body=self.body,
+        )
+
+    def apply(self, message: Message) -> None:
+        if self.apply_values(
+            message["version"],
+            {
+                "type": model.QuestionType(message["fields"]["type"]),
+                "body": message["fields"]["body"],
+            },
+        ):
+            notify_unsaved_conflict("question")
+
+    def apply_response_change(self, message: Message) -> None:
+        response_id = UUID(message["id"])
+        response = next((r for r in self.responses if r.id == response_id), None)
+        if message["op"] == "create" and response is None:
+            response = ExamTemplateQuestionResponse(
+                id=response_id,
+                exam_template_question_id=self.id,
+                value=message["fields"]["value"],
+                is_correct=message["fields"]["is_correct"],
+                exam_template_id=self.exam_template_id,
+                version=message["version"],
+            )
+            self.responses.append(response)
+            self.show_response(response)
+        elif (
+            message["op"] == "update"
+            and response is not None
+            and message["version"] > response.version
+        ):
+            response.apply(message)
+        elif message["op"] == "delete" and response is not None:
+            self.responses.remove(response)
+            response.remove_row()
+
+    def show_response(self, response: ExamTemplateQuestionResponse) -> None:
+        if self._responses_column is not None:
+            with self._responses_column:
+                # Responses are listed newest first
+                response.edit(self).move(target_index=0)
+
     async def add_response(self, response: ExamTemplateQuestionResponse) -> None:
+        response.exam_template_id = self.exam_template_id
         self.responses.append(response)
         await response.new()
-        self.edit.refresh()
+        self.show_response(response)
 
     async def delete_response(self, response: ExamTemplateQuestionResponse) -> None:
         self.responses.remove(response)
         await response.delete()
-        self.edit.refresh()
 
     async def toggle_response_correct(
         self, response: ExamTemplateQuestionResponse
     ) -> None:
         response.is_correct = not response.is_correct
         await response.save()
-        self.edit.refresh()
 
     @staticmethod
     async def load(from_value: model.ExamTemplateQuestion) -> any:
@@ -133,23 +343,38 @@ class ExamTemplateQuestion(Serializable):
             type=from_value.type,
             body=from_value.body,
             responses=[],
+            version=from_value.version,
         )
         for response in from_value.responses:
-            exam_template_question.responses.append(
-                await ExamTemplateQuestionResponse.load(response)
+            exam_template_question_response = await ExamTemplateQuestionResponse.load(
+                response
             )
+            exam_template_question_response.exam_template_id = exam_template_id
+            exam_template_question.responses.append(exam_template_question_response)
         return exam_template_question
 
+    def new_response_input(self) -> None:
+        async def add_response() -> None:
+            await self.add_response(
+                ExamTemplateQuestionResponse(
+                    id=None,
+                    exam_template_question_id=self.id,
+                    value=new_response_value.value,
+                    is_correct=False,
+                )
+            )
+            new_response_value.value = ""
+
+        with ui.row():
+            new_response_value = ui.input()
+            ui.button(on_click=add_response, icon="add").props("flat").classes(
+                "ml-auto"
+            )
+
     @ui.refreshable
     async def create(self) -> None:
         if not self.id:
-            exam_template_question = await model.ExamTemplateQuestion.create(
-                exam_template_id=self.exam_template_id, type=self.type, body=self.body
-            )
-            self.id = exam_template_question.id
-        new_response = ExamTemplateQuestionResponse(
-            id=None, exam_template_question_id=self.id, value="", is_correct=False
-        )
+            await self.new()
         with ui.row():
             ui.select(
                 options={t.value: t.name for t in model.QuestionType}, label="Type"
@@ -158,28 +383,38 @@ class ExamTemplateQuestion(Serializable):
                 self, "body"
             )
             with ui.column():
-                with ui.row():
-                    ui.input().bind_value(new_response, "value")
-                    ui.button(
-                        on_click=lambda: self.add_response(new_response), icon="add"
-                    ).props("flat")
-                for response in reversed(self.responses):
-                    await response.edit()
+                self.new_response_input()
+                with ui.column() as self._responses_column:
+                    for response in reversed(self.responses):
+                        response.edit(self)
             ui.button(on_click=self.new, icon="save").props("flat")
 
-    @ui.refreshable
-    async def edit(self) -> None:
-        if not self.id:
-            exam_template_question = await model.ExamTemplateQuestion.create(
-                exam_template_id=self.exam_template_id,
-                type=self.type,
-                body=self.body,
+    def selection_rate(self, response_id: UUID) -> Optional[float]:
+        if self._statistics is None:
+            return None
+        return self._statistics.selection_rates.get(response_id)
+
+    def show_statistics(self) -> None:
+        if self._statistics is None:
+            return
+        difficulty = self._statistics.difficulty
+        discrimination = self._statistics.discrimination
+        with ui.row().classes("items-center"):
+            ui.label(f"Attempts: {self._statistics.num_attempts}")
+            ui.label(f"Difficulty: {difficulty:.2f}").tooltip(
+                "Share of attempts answering correctly"
             )
-            self.id = exam_template_question.id
-        new_response = ExamTemplateQuestionResponse(
-            id=None, exam_template_question_id=self.id, value="", is_correct=False
-        )
+            if discrimination is not None:
+                ui.label(f"Discrimination: {discrimination:.2f}").tooltip(
+                    "Point-biserial correlation with the total score"
+                )
+
+    async def edit(self, statistics: Optional[QuestionStatistics] = None) -> None:
+        if not self.id:
+            await self.new()
+        self._statistics = statistics
 
+        self.show_statistics()
         ui.select(
             options={t.value: t.name for t in model.QuestionType}, label="Type"
         ).on(type="blur", handler=self.save).bind_value(self, "type")
@@ -187,22 +422,10 @@ class ExamTemplateQuestion(Serializable):
             type="blur", handler=self.save
         ).bind_value(self, "body")
         with ui.column():
-            with ui.row():
-                ui.input().bind_value(new_response, "value")
-                ui.button(
-                    on_click=lambda: self.add_response(new_response), icon="add"
-                ).props("flat").classes("ml-auto")
-            for response in reversed(self.responses):
-                with ui.row():
-                    await response.edit()
-                    ui.button(
-                        on_click=lambda r=response: self.toggle_response_correct(r),
-                        icon="check",
-                    )
-                    ui.button(
-                        on_click=lambda r=response: self.delete_response(r),
-                        icon="delete",
-                    ).props("flat").classes("ml-auto")
+            self.new_response_input()
+            with ui.column() as self._responses_column:
+                for response in reversed(self.responses):
+                    response.edit(self)
 
 
 @dataclass
@@ -211,8 +434,26 @@ class ExamTemplate(Serializable):
     id: UUID
     name: str
     questions: List[ExamTemplateQuestion] = field(default_factory=lambda: [])
+    time_limit: Optional[int] = None
 
     selected_question: int = 1
+    version: int = 1
+
+    _pagination: Optional[ui.pagination] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _questions_container: Optional[ui.column] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _question_cards: dict[UUID, ui.card] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _subscriber: Optional[Callable] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _statistics: Optional[ItemStatistics] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     async def new(self) -> None:
         author = await User.get_active()
@@ -220,26 +461,123 @@ class ExamTemplate(Serializable):
             name=self.name, author=author, updated_by=author
         )
         self.id = exam_template.id
+        self.mark_saved()
         self.create.refresh()
         ui.navigate.to(f"/admin/exam/template/{exam_template.id}")
 
+    def values(self) -> dict[str, any]:
+        # ui.number binds floats, the column holds whole minutes
+        return {
+            "name": self.name,
+            "time_limit": int(self.time_limit) if self.time_limit else None,
+        }
+
     async def save(self) -> None:
-        exam_template = await model.ExamTemplate.get(id=self.id)
-        exam_template.name = self.name
-        exam_template.updated_by = await User.get_active()
-        await exam_template.save()
+        # Questions and responses persist themselves as they are edited
+        if not self.is_dirty():
+            return
+        values = self.values()
+        try:
+            self.version = await save_versioned(
+                model.ExamTemplate,
+                self.id,
+                self.version,
+                **values,
+                updated_by=await User.get_active(),
+                updated=timezone.now(),
+            )
+        except ConcurrentModificationError:
+            await self.reload()
+            notify_conflict("exam template")
+            return
+        self.mark_saved()
+        await publish_change(
+            self.id, "exam_template", "update", self.id, self.version, **values
+        )
 
-        for question in self.questions:
-            await question.save()
-        self.edit.refresh()
+    async def reload(self) -> None:
+        exam_template = await model.ExamTemplate.get(id=self.id)
+        self.name = exam_template.name
+        self.time_limit = exam_template.time_limit
+        self.version = exam_template.version
+        self.mark_saved()
+
+    async def touch(self) -> None:
+        """Records who last changed the questions without bumping the version"""
+        await model.ExamTemplate.filter(id=self.id).update(
+            updated_by=await User.get_active(), updated=timezone.now()
+        )
+        response_cache.invalidate(exam_template_tag(self.id))
 
     @staticmethod
     async def load(from_value: model.ExamTemplate) -> any:
-        exam_template = ExamTemplate(id=from_value.id, name=from_value.name)
+        exam_template = ExamTemplate(
+            id=from_value.id,
+            name=from_value.name,
+            time_limit=from_value.time_limit,
+            version=from_value.version,
+        )
         for question in from_value.questions:
             exam_template.questions.append(await ExamTemplateQuestion.load(question))
         return exam_template
 
+    def find_question(self, id: UUID) -> Optional[ExamTemplateQuestion]:
+        return next((q for q in self.questions if q.id == id), None)
+
+    async def apply_change(self, message: Message) -> None:
+        """Applies a change broadcast by another editor of this template"""
+        if message["entity"] == "exam_template":
+            if message["version"] > self.version and self.apply_values(
+                message["version"], message["fields"]
+            ):
+                notify_unsaved_conflict("exam template")
+        elif message["entity"] == "question":
+            question_id = UUID(message["id"])
+            question = self.find_question(question_id)
+            if message["op"] == "create" and question is None:
+                self.questions.append(
+                    ExamTemplateQuestion(
+                        id=question_id,
+                        exam_template_id=self.id,
+                        type=model.QuestionType(message["fields"]["type"]),
+                        body=message["fields"]["body"],
+                        version=message["version"],
+                    )
+                )
+                self.update_pagination()
+            elif (
+                message["op"] == "update"
+                and question is not None
+                and message["version"] > question.version
+            ):
+                question.apply(message)
+            elif message["op"] == "delete" and question is not None:
+                await self.remove_question(question)
+        elif message["entity"] == "response":
+            question = self.find_question(
+                UUID(message["fields"]["exam_template_question_id"])
+            )
+            if question is not None:
+                question.apply_response_change(message)
+
+    def subscribe(self) -> None:
+        if self._subscriber is not None:
+            return
+        client = context.client
+        topic = exam_template_topic(self.id)
+
+        async def apply_change(message: Message) -> None:
+            with client:
+                await self.apply_change(message)
+
+        def unsubscribe() -> None:
+            get_broadcaster().unsubscribe(topic, apply_change)
+            self._subscriber = None
+
+        self._subscriber = apply_change
+        get_broadcaster().subscribe(topic, apply_change)
+        client.on_disconnect(unsubscribe)
+
     async def add_question(self) -> None:
         new_question = ExamTemplateQuestion(
             id=None,
@@ -247,17 +585,59 @@ class ExamTemplate(Serializable):
             type=model.QuestionType.MULTIPLE_CHOICE_SINGLE_SELECT,
             body="",
         )
-        await new_question.new()
         self.questions.append(new_question)
-        await self.save()
-        self.edit_card.refresh()
+        await new_question.new()
+        await self.touch()
+        self.update_pagination()
+        self.selected_question = len(self.questions)
+        await self.show_question()
 
     async def delete_question(self, question: ExamTemplateQuestion) -> None:
-        self.questions.remove(question)
+        await self.remove_question(question)
         await question.delete()
-        await self.save()
+        await self.touch()
+
+    async def remove_question(self, question: ExamTemplateQuestion) -> None:
+        card = self._question_cards.pop(question.id, None)
+        self.questions.remove(question)
+        if card is not None:
+            card.delete()
+        self.update_pagination()
         self.selected_question = 1
-        self.edit_card.refresh()
+        await self.show_question()
+
+    def update_pagination(self) -> None:
+        if self._pagination is not None:
+            self._pagination.max = max(len(self.questions), 1)
+
+    async def show_question(self) -> None:
+        """Shows the selected question's card, building it on first selection"""
+        if self._questions_container is None or not self.questions:
+            return
+        self.selected_question = min(
+            max(self.selected_question, 1), len(self.questions)
+        )
+        question = self.questions[self.selected_question - 1]
+        for question_id, card in self._question_cards.items():
+            card.set_visibility(question_id == question.id)
+        if question.id not in self._question_cards:
+            with self._questions_container:
+                self._question_cards[question.id] = await self.question_card(question)
+
+    async def question_card(self, question: ExamTemplateQuestion) -> ui.card:
+        with ui.card() as card:
+            with ui.card_actions().classes("w-full justify-end"):
+                ui.button(
+                    on_click=lambda q=question: self.delete_question(q),
+                    icon="close",
+                )
+            with ui.row():
+                await question.edit(
+                    self._statistics.question(question.id)
+                    if self._statistics is not None
+                    else None
+                )
+        return card
 
     @ui.refreshable
     async def create(self) -> None:
@@ -266,38 +646,38 @@ class ExamTemplate(Serializable):
                 ui.input(label="Name").bind_value(self, "name")
                 ui.button(on_click=self.new, icon="add").props("flat")
 
-    # Inner Edit card is separated into its own method to allow refreshing without breaking pagination
-
-    @ui.refreshable
-    async def edit_card(self) -> None:
-        question = self.questions[self.selected_question - 1]
-        with ui.card():
-            with ui.card_actions().classes("w-full justify-end"):
-                ui.button(
-                    on_click=lambda q=question: self.delete_question(q),
-                    icon="close",
-                )
-            with ui.row():
-                await question.edit()
+    # Each question gets its own card, kept alive between page changes so pagination only
+    # toggles visibility instead of re-rendering the editor
 
     @ui.refreshable
     async def edit(self) -> None:
+        self.subscribe()
+        self._statistics = await item_analyzer.get(self.id)
+        self._question_cards.clear()
         with ui.card().classes("absolute-center items-center w-full mx-auto"):
             with ui.card_section():
                 ui.input("Exam Name").on(type="blur", handler=self.save).bind_value(
                     self, "name"
                 )
+                ui.number("Time Limit (minutes)", min=0, format="%d").on(
+                    type="blur", handler=self.save
+                ).bind_value(self, "time_limit")
                 ui.button(text="Add Question", on_click=self.add_question).props("flat")
             ui.separator()
             with ui.card_section():
                 with ui.row():
-                    ui.pagination(
-                        1,
-                        len(self.questions),
-                        direction_links=True,
-                        on_change=self.edit_card.refresh,
-                    ).classes("mx-auto").bind_value(self, "selected_question")
-                await self.edit_card()
+                    self._pagination = (
+                        ui.pagination(
+                            1,
+                            max(len(self.questions), 1),
+                            direction_links=True,
+                            on_change=self.show_question,
+                        )
+                        .classes("mx-auto")
+                        .bind_value(self, "selected_question")
+                    )
+                with ui.column() as self._questions_container:
+                    await self.show_question()
 
     @ui.refreshable
     async def summary(self) -> None:
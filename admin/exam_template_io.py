@@ -0,0 +1,212 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+from typing import AsyncIterator, BinaryIO, Iterator
+
+import config
+import model
+import orjson
+import yaml
+
+from tortoise.transactions import in_transaction
+
+# Question banks are moved as a stream of templates, one per JSON line or YAML document:
+#
+#   name: MPLS Fundamentals
+#   time_limit: 30
+#   questions:
+#     - type: MULTIPLE_CHOICE_SINGLE_SELECT
+#       body: What does LDP distribute?
+#       responses:
+#         - value: Labels
+#           is_correct: true
+#
+# Both directions hold at most one chunk of templates in memory.
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class TemplateImportError(ValueError):
+    """Raised when an imported template does not validate"""
+
+    def __init__(self, index: int, message: str, imported: int = 0) -> None:
+        super().__init__(f"Template #{index}: {message}")
+        self.index = index
+        # Templates committed in earlier chunks before the import stopped
+        self.imported = imported
+
+
+def read_json_lines(stream: BinaryIO) -> Iterator[dict]:
+    for line in stream:
+        if line.strip():
+            yield orjson.loads(line)
+
+
+def read_yaml_documents(stream: BinaryIO) -> Iterator[dict]:
+    for document in yaml.load_all(stream, Loader=YAML_LOADER):
+        if document is not None:
+            yield document
+
+
+def parse_question_type(index: int, value: any) -> model.QuestionType:
+    try:
+        if isinstance(value, str):
+            return model.QuestionType[value]
+        return model.QuestionType(value)
+    except (KeyError, ValueError):
+        raise TemplateImportError(index, f"Unknown question type: {value!r}")
+
+
+def validate_template(index: int, data: any) -> dict:
+    """Checks an imported template and normalizes its question types"""
+    if not isinstance(data, dict):
+        raise TemplateImportError(index, "Expected a mapping")
+    if not isinstance(data.get("name"), str) or not data["name"]:
+        raise TemplateImportError(index, "Missing name")
+    time_limit = data.get("time_limit")
+    if time_limit is not None and (not isinstance(time_limit, int) or time_limit < 0):
+        raise TemplateImportError(index, f"Invalid time_limit: {time_limit!r}")
+    questions = data.get("questions", [])
+    if not isinstance(questions, list):
+        raise TemplateImportError(index, "questions must be a list")
+    for question in questions:
+        if not isinstance(question, dict) or not isinstance(question.get("body"), str):
+            raise TemplateImportError(index, "Every question needs a body")
+        question["type"] = parse_question_type(
+            index,
+            question.get("type", model.QuestionType.MULTIPLE_CHOICE_SINGLE_SELECT),
+        )
+        responses = question.get("responses", [])
+        if not isinstance(responses, list) or not all(
+            isinstance(r, dict)
+            and isinstance(r.get("value"), str)
+            and isinstance(r.get("is_correct", False), bool)
+            for r in responses
+        ):
+            raise TemplateImportError(
+                index, "Every response needs a value and a boolean is_correct"
+            )
+    return data
+
+
+async def insert_templates(templates: list[dict], author: model.User) -> None:
+    exam_templates = []
+    questions = []
+    responses = []
+    for data in templates:
+        exam_template = model.ExamTemplate(
+            name=data["name"],
+            time_limit=data.get("time_limit"),
+            author=author,
+            updated_by=author,
+        )
+        exam_templates.append(exam_template)
+        for question_data in data.get("questions", []):
+            question = model.ExamTemplateQuestion(
+                exam_template_id=exam_template.id,
+                type=question_data["type"],
+                body=question_data["body"],
+            )
+            questions.append(question)
+            for response_data in question_data.get("responses", []):
+                responses.append(
+                    model.ExamTemplateQuestionResponse(
+                        exam_template_question_id=question.id,
+                        value=response_data["value"],
+                        is_correct=response_data.get("is_correct", False),
+                    )
+                )
+    async with in_transaction():
+        await model.ExamTemplate.bulk_create(exam_templates)
+        await model.ExamTemplateQuestion.bulk_create(questions)
+        await model.ExamTemplateQuestionResponse.bulk_create(responses)
+
+
+async def import_templates(
+    documents: Iterator[dict],
+    author: model.User,
+    chunk_size: int = config.TEMPLATE_IMPORT_CHUNK_SIZE,
+) -> int:
+    """Validates and inserts templates chunk by chunk, returns how many were imported
+
+    Each chunk of about chunk_size rows is inserted in its own transaction, so an
+    invalid template stops the import but keeps the chunks committed before it. The
+    TemplateImportError raised then tells how many templates those chunks held.
+    """
+    imported = 0
+    chunk = []
+    num_rows = 0
+    index = 0
+    try:
+        for index, data in enumerate(documents, start=1):
+            template = validate_template(index, data)
+            chunk.append(template)
+            num_rows += 1 + sum(
+                1 + len(question.get("responses", []))
+                for question in template.get("questions", [])
+            )
+            if num_rows >= chunk_size:
+                await insert_templates(chunk, author)
+                imported += len(chunk)
+                chunk = []
+                num_rows = 0
+        if chunk:
+            await insert_templates(chunk, author)
+            imported += len(chunk)
+    except TemplateImportError as error:
+        error.imported = imported
+        raise
+    except (orjson.JSONDecodeError, yaml.YAMLError) as error:
+        raise TemplateImportError(
+            index + 1, f"Could not be parsed: {error}", imported
+        ) from error
+    return imported
+
+
+def export_template(exam_template: model.ExamTemplate) -> dict:
+    return {
+        "name": exam_template.name,
+        "time_limit": exam_template.time_limit,
+        "questions": [
+            {
+                "type": model.QuestionType(question.type).name,
+                "body": question.body,
+                "responses": [
+                    {"value": response.value, "is_correct": response.is_correct}
+                    for response in question.responses
+                ],
+            }
+            for question in exam_template.questions
+        ],
+    }
+
+
+async def export_templates(
+    format: str, page_size: int = config.TEMPLATE_EXPORT_PAGE_SIZE
+) -> AsyncIterator[bytes]:
+    """Streams every template as JSON Lines or YAML documents, a page at a time"""
+    last_id = None
+    while True:
+        query = model.ExamTemplate.all().order_by("id").limit(page_size)
+        if last_id is not None:
+            query = query.filter(id__gt=last_id)
+        exam_templates = await query.prefetch_related("questions__responses")
+        if not exam_templates:
+            return
+        for exam_template in exam_templates:
+            data = export_template(exam_template)
+            if format == "yaml":
+                yield yaml.dump(
+                    data,
+                    Dumper=YAML_DUMPER,
+                    explicit_start=True,
+                    sort_keys=False,
+                    allow_unicode=True,
+                ).encode()
+            else:
+                yield orjson.dumps(data) + b"\n"
+        last_id = exam_templates[-1].id
@@ -0,0 +1,262 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import logging
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import UUID
+
+import config
+import model
+import orjson
+
+from item_analysis import item_analyzer
+from response_cache import exam_tag, response_cache, user_tag
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+logger = logging.getLogger(__name__)
+
+# Completed exams older than the retention window are moved out of the tables every live
+# query touches. Each one leaves a single ArchivedExam row behind: the summary columns
+# the results pages need, and its questions and answers as one zlib-compressed JSON
+# payload that rehydrate_exam() turns back into rows when somebody opens the exam.
+#
+# Item statistics are scanned from the live tables, so they cover the retention window.
+# Archiving drops the cached statistics of the affected templates, the next view
+# rescans them, so the numbers match before and after a restart.
+
+
+@dataclass
+class ExamResult:
+    id: UUID
+    name: str
+    completed: Optional[datetime]
+    score: Optional[float]
+    is_archived: bool
+
+
+def pack_exam(exam: model.Exam) -> bytes:
+    return zlib.compress(
+        orjson.dumps(
+            [
+                {
+                    "id": question.id,
+                    "type": question.type,
+                    "body": question.body,
+                    "exam_template_question_id": question.exam_template_question_id,
+                    "responses": [
+                        {
+                            "id": response.id,
+                            "exam_template_question_response_id": response.exam_template_question_response_id,
+                            "submitted_datetime": response.submitted_datetime,
+                            "is_submitted": response.is_submitted,
+                        }
+                        for response in question.response
+                    ],
+                }
+                for question in exam.questions
+            ]
+        )
+    )
+
+
+def unpack_exam(
+    archived_exam: model.ArchivedExam,
+) -> tuple[model.Exam, list[model.ExamQuestion], list[model.ExamQuestionResponse]]:
+    exam = model.Exam(
+        id=archived_exam.id,
+        user_id=archived_exam.user_id,
+        name=archived_exam.name,
+        is_complete=True,
+        time_limit=archived_exam.time_limit,
+        started=archived_exam.started,
+        completed=archived_exam.completed,
+        score=archived_exam.score,
+    )
+    questions = []
+    responses = []
+    for question in orjson.loads(zlib.decompress(archived_exam.payload)):
+        questions.append(
+            model.ExamQuestion(
+                id=UUID(question["id"]),
+                exam_id=exam.id,
+                type=model.QuestionType(question["type"]),
+                body=question["body"],
+                exam_template_question_id=question["exam_template_question_id"],
+            )
+        )
+        for response in question["responses"]:
+            responses.append(
+                model.ExamQuestionResponse(
+                    id=UUID(response["id"]),
+                    exam_question_id=questions[-1].id,
+                    exam_template_question_response_id=response[
+                        "exam_template_question_response_id"
+                    ],
+                    submitted_datetime=datetime.fromisoformat(
+                        response["submitted_datetime"]
+                    ),
+                    is_submitted=response["is_submitted"],
+                )
+            )
+    return exam, questions, responses
+
+
+async def archive_exams(exam_ids: list[UUID]) -> int:
+    """Moves the given exams into the archive in one transaction"""
+    exams = await model.Exam.filter(id__in=exam_ids).prefetch_related(
+        "questions__response"
+    )
+    if not exams:
+        return 0
+    archived_exams = [
+        model.ArchivedExam(
+            id=exam.id,
+            user_id=exam.user_id,
+            name=exam.name,
+            time_limit=exam.time_limit,
+            started=exam.started,
+            completed=exam.completed,
+            score=exam.score,
+            num_questions=len(exam.questions),
+            payload=pack_exam(exam),
+        )
+        for exam in exams
+    ]
+    ids = [exam.id for exam in exams]
+    exam_template_ids = (
+        await model.ExamTemplateQuestion.filter(exam_questions__exam_id__in=ids)
+        .distinct()
+        .values_list("exam_template_id", flat=True)
+    )
+    async with in_transaction():
+        await model.ArchivedExam.bulk_create(archived_exams)
+        exam_question_ids = await model.ExamQuestion.filter(
+            exam_id__in=ids
+        ).values_list("id", flat=True)
+        await model.ExamQuestionResponse.filter(
+            exam_question_id__in=exam_question_ids
+        ).delete()
+        await model.ExamQuestion.filter(exam_id__in=ids).delete()
+        await model.Exam.filter(id__in=ids).delete()
+    response_cache.invalidate(*map(exam_tag, ids))
+    item_analyzer.forget(exam_template_ids)
+    return len(exams)
+
+
+async def rehydrate_exam(exam_id: UUID) -> Optional[model.Exam]:
+    """Moves an archived exam back into the live tables, None if it is not archived
+
+    The exam stays live until the next archiver pass picks it up again.
+    """
+    async with in_transaction():
+        archived_exam = await model.ArchivedExam.get_or_none(id=exam_id)
+        if archived_exam is None:
+            return None
+        exam, questions, responses = unpack_exam(archived_exam)
+        # The live foreign keys are SET_NULL, do the same for template questions and
+        # responses deleted while the exam was archived
+        question_ids = set(
+            await model.ExamTemplateQuestion.filter(
+                id__in={q.exam_template_question_id for q in questions} - {None}
+            ).values_list("id", flat=True)
+        )
+        response_ids = set(
+            await model.ExamTemplateQuestionResponse.filter(
+                id__in={r.exam_template_question_response_id for r in responses}
+                - {None}
+            ).values_list("id", flat=True)
+        )
+        for question in questions:
+            if question.exam_template_question_id not in question_ids:
+                question.exam_template_question_id = None
+        for response in responses:
+            if response.exam_template_question_response_id not in response_ids:
+                response.exam_template_question_response_id = None
+        submitted_datetimes = [response.submitted_datetime for response in responses]
+        await exam.save(force_create=True)
+        await model.ExamQuestion.bulk_create(questions)
+        await model.ExamQuestionResponse.bulk_create(responses)
+        # submitted_datetime is auto_now, inserting stamps it with the current time
+        for response, submitted_datetime in zip(responses, submitted_datetimes):
+            await model.ExamQuestionResponse.filter(id=response.id).update(
+                submitted_datetime=submitted_datetime
+            )
+        await archived_exam.delete()
+    response_cache.invalidate(user_tag(exam.user_id))
+    return exam
+
+
+async def exam_results(user_id: UUID) -> list[ExamResult]:
+    """Lists a user's completed exams, live and archived, newest first"""
+    fields = ("id", "name", "completed", "score")
+    live = await model.Exam.filter(user_id=user_id, is_complete=True).values_list(
+        *fields
+    )
+    archived = await model.ArchivedExam.filter(user_id=user_id).values_list(*fields)
+    results = [ExamResult(*row, is_archived=False) for row in live] + [
+        ExamResult(*row, is_archived=True) for row in archived
+    ]
+    return sorted(
+        results,
+        key=lambda result: (result.completed is not None, result.completed),
+        reverse=True,
+    )
+
+
+class ExamArchiver:
+    """Periodically archives exams completed before the retention window
+
+    Exams whose grading failed are archived too, their score stays empty.
+    """
+
+    def __init__(self, retention: timedelta, batch_size: int, interval: float) -> None:
+        self.retention = retention
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> int:
+        """Archives every expired exam, a batch per transaction, returns how many"""
+        cutoff = timezone.now() - self.retention
+        archived = 0
+        while True:
+            exam_ids = (
+                await model.Exam.filter(is_complete=True, completed__lt=cutoff)
+                .limit(self.batch_size)
+                .values_list("id", flat=True)
+            )
+            if not exam_ids:
+                return archived
+            archived += await archive_exams(exam_ids)
+
+    async def loop(self) -> None:
+        while True:
+            try:
+                archived = await self.run()
+                logger.info(f"[ExamArchiver.loop] Archived {archived} exams")
+            except Exception:
+                logger.exception("[ExamArchiver.loop] Failed to archive exams")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+exam_archiver = ExamArchiver(
+    retention=timedelta(days=config.EXAM_RETENTION_DAYS),
+    batch_size=config.EXAM_ARCHIVE_BATCH_SIZE,
+    interval=config.EXAM_ARCHIVE_INTERVAL,
+)
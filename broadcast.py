@@ -0,0 +1,80 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import inspect
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+Message = dict[str, Any]
+Subscriber = Callable[[Message], Any]
+
+
+class Broadcaster(ABC):
+    """Publish/subscribe channel for change notifications between clients
+
+    Messages are plain dicts of JSON types only, ids as strings and datetimes as ISO
+    strings, so a multi-worker backend can forward them over an external broker and
+    subscribers see the same values either way. Subscribers convert ids back with UUID().
+    """
+
+    @abstractmethod
+    def subscribe(self, topic: str, subscriber: Subscriber) -> None:
+        pass
+
+    @abstractmethod
+    def unsubscribe(self, topic: str, subscriber: Subscriber) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, topic: str, message: Message) -> None:
+        pass
+
+
+class InProcessBroadcaster(Broadcaster):
+    """Delivers messages to subscribers living in the same worker process"""
+
+    def __init__(self) -> None:
+        self._subscribers: defaultdict[str, list[Subscriber]] = defaultdict(list)
+
+    def subscribe(self, topic: str, subscriber: Subscriber) -> None:
+        self._subscribers[topic].append(subscriber)
+
+    def unsubscribe(self, topic: str, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(topic)
+        if subscribers and subscriber in subscribers:
+            subscribers.remove(subscriber)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    async def publish(self, topic: str, message: Message) -> None:
+        for subscriber in list(self._subscribers.get(topic, ())):
+            try:
+                result = subscriber(message)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception(f"[publish] Subscriber failed on topic {topic}")
+
+
+_broadcaster: Broadcaster = InProcessBroadcaster()
+
+
+def get_broadcaster() -> Broadcaster:
+    return _broadcaster
+
+
+def set_broadcaster(broadcaster: Broadcaster) -> None:
+    """Replaces the process-wide broadcaster, e.g. with a broker-backed one"""
+    global _broadcaster
+    _broadcaster = broadcaster
+
+
+def exam_template_topic(exam_template_id) -> str:
+    return f"exam_template:{exam_template_id}"
@@ -8,6 +8,7 @@ ENTRA_TENANT_ID: Final[str] = "9936d6dc-55b6-427a-a12c-f0a4510ff303"
 ENTRA_APPLICATION_SCOPE: Final[list[str]] = ["User.ReadBasic.All"]
 ENTRA_AUTHORITY: Final[str] = f"https://login.microsoftonline.com/{ENTRA_TENANT_ID}"
 ENTRA_GRAPH_ENDPOINT: Final[str] = "https://graph.microsoft.com/v1.0/users"
+ENTRA_GRAPH_SCOPE: Final[list[str]] = ["https://graph.microsoft.com/.default"]
 ENTRA_LOGOUT_ENDPOINT: Final[str] = (
     f"https://login.microsoftonline.com/{ENTRA_TENANT_ID}/oauth2/v2.0/logout"
 )
@@ -15,3 +16,20 @@ ENTRA_JWKS_URL: Final[str] = (
     f"https://login.microsoftonline.com/{ENTRA_TENANT_ID}/discovery/v2.0/keys"
 )
 OAUTH_REDIRECT_URI: Final[str] = "/auth/callback"
+
+# Upper bound for the element updates a single template edit should push over the
+# websocket. Edits touching one keyed component stay well under it.
+EDIT_PAYLOAD_LIMIT_BYTES: Final[int] = 4096
+PROCTOR_PUSH_INTERVAL: Final[float] = 1.0
+DEADLINE_BATCH_SIZE: Final[int] = 100
+DEADLINE_MIN_TICK: Final[float] = 0.1
+DEADLINE_RETRY_DELAY: Final[float] = 1.0
+DEADLINE_MAX_RETRIES: Final[int] = 10
+TEMPLATE_IMPORT_CHUNK_SIZE: Final[int] = 1000
+TEMPLATE_EXPORT_PAGE_SIZE: Final[int] = 20
+DIRECTORY_SYNC_INTERVAL: Final[float] = 60 * 60
+DIRECTORY_SYNC_BATCH_SIZE: Final[int] = 200
+EXAM_RETENTION_DAYS: Final[int] = 365
+EXAM_ARCHIVE_BATCH_SIZE: Final[int] = 500
+EXAM_ARCHIVE_INTERVAL: Final[float] = 24 * 60 * 60
+API_CACHE_SIZE: Final[int] = 1024
@@ -0,0 +1,219 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import config
+import httpx
+import model
+import msal
+
+from response_cache import response_cache, user_tag
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+logger = logging.getLogger(__name__)
+
+TokenProvider = Callable[[], Awaitable[str]]
+
+GRAPH_USER_FIELDS = "id,displayName,mail,userPrincipalName"
+
+
+@dataclass
+class DirectorySyncResult:
+    created: int = 0
+    updated: int = 0
+    deactivated: int = 0
+
+
+async def acquire_graph_token() -> str:
+    """Gets an app-only Graph token with the client credentials of the Entra app"""
+    application = msal.ConfidentialClientApplication(
+        client_id=config.ENTRA_CLIENT_ID,
+        client_credential=config.ENTRA_CLIENT_SECRET,
+        authority=config.ENTRA_AUTHORITY,
+    )
+    token = await asyncio.to_thread(
+        application.acquire_token_for_client, scopes=config.ENTRA_GRAPH_SCOPE
+    )
+    if "access_token" not in token:
+        raise RuntimeError(
+            f"[acquire_graph_token] {token.get('error')}: "
+            f"{token.get('error_description')}"
+        )
+    return token["access_token"]
+
+
+def user_email(entry: dict) -> Optional[str]:
+    # Sign-in stores preferred_username, which is the user principal name
+    return entry.get("userPrincipalName") or entry.get("mail")
+
+
+def merge_entries(entries: list[dict]) -> list[dict]:
+    """Collapses repeated entries for the same object, later ones win
+
+    A delta page may return an object more than once, each time with the properties
+    that changed, so updates are merged while a removal replaces what came before.
+    """
+    merged: dict[str, dict] = {}
+    for entry in entries:
+        previous = merged.get(entry["id"])
+        if previous is None or "@removed" in entry or "@removed" in previous:
+            merged[entry["id"]] = entry
+        else:
+            merged[entry["id"]] = previous | entry
+    return list(merged.values())
+
+
+class DirectorySync:
+    """Keeps model.User in step with the Entra directory using Graph delta queries
+
+    The first run pages through every user, later runs resume from the stored delta
+    link and only receive what changed since. Each page is upserted in batches keyed by
+    the directory object id, users reported as removed are marked inactive.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        token_provider: TokenProvider,
+        batch_size: int,
+        interval: float,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        self.endpoint = endpoint
+        self.token_provider = token_provider
+        self.batch_size = batch_size
+        self.interval = interval
+        self.http_client = http_client or httpx.AsyncClient(timeout=60)
+        self._task: Optional[asyncio.Task] = None
+
+    async def upsert(self, entries: list[dict]) -> DirectorySyncResult:
+        result = DirectorySyncResult()
+        entries = merge_entries(entries)
+        removed = [entry["id"] for entry in entries if "@removed" in entry]
+        present = [entry for entry in entries if "@removed" not in entry]
+
+        async with in_transaction():
+            existing = {
+                user.object_id: user
+                for user in await model.User.filter(
+                    object_id__in=[entry["id"] for entry in present]
+                )
+            }
+            # Users who signed in before the first sync only have their email to go by
+            emails = [
+                user_email(entry) for entry in present if entry["id"] not in existing
+            ]
+            unlinked = {
+                user.email: user
+                for user in await model.User.filter(
+                    object_id__isnull=True, email__in=[e for e in emails if e]
+                )
+            }
+
+            to_create = []
+            to_update = []
+            for entry in present:
+                user = existing.get(entry["id"]) or unlinked.pop(
+                    user_email(entry), None
+                )
+                # Delta pages may carry only the properties that changed
+                name = entry.get("displayName")
+                email = user_email(entry)
+                if user is None:
+                    if name is None or email is None:
+                        continue
+                    to_create.append(
+                        model.User(
+                            object_id=entry["id"],
+                            name=name,
+                            email=email,
+                            is_active=True,
+                        )
+                    )
+                    continue
+                user.object_id = entry["id"]
+                user.name = name if name is not None else user.name
+                user.email = email if email is not None else user.email
+                user.is_active = True
+                to_update.append(user)
+
+            if to_create:
+                await model.User.bulk_create(to_create)
+            if to_update:
+                await model.User.bulk_update(
+                    to_update, fields=["object_id", "name", "email", "is_active"]
+                )
+            if removed:
+                result.deactivated = await model.User.filter(
+                    object_id__in=removed, is_active=True
+                ).update(is_active=False)
+        response_cache.invalidate(*(user_tag(user.id) for user in to_update))
+        result.created = len(to_create)
+        result.updated = len(to_update)
+        return result
+
+    async def run(self) -> DirectorySyncResult:
+        state, _ = await model.DirectorySyncState.get_or_create(id=1)
+        url = state.delta_link or f"{self.endpoint}/delta?$select={GRAPH_USER_FIELDS}"
+        result = DirectorySyncResult()
+        headers = {"Authorization": f"Bearer {await self.token_provider()}"}
+
+        while url:
+            response = await self.http_client.get(url, headers=headers)
+            if response.status_code == httpx.codes.GONE and state.delta_link:
+                # The delta token expired, start over with a full sync
+                logger.warning("[DirectorySync.run] Delta token expired, resyncing")
+                state.delta_link = None
+                url = f"{self.endpoint}/delta?$select={GRAPH_USER_FIELDS}"
+                continue
+            response.raise_for_status()
+            page = response.json()
+
+            entries = page.get("value", [])
+            for i in range(0, len(entries), self.batch_size):
+                batch = await self.upsert(entries[i : i + self.batch_size])
+                result.created += batch.created
+                result.updated += batch.updated
+                result.deactivated += batch.deactivated
+
+            url = page.get("@odata.nextLink")
+            if "@odata.deltaLink" in page:
+                state.delta_link = page["@odata.deltaLink"]
+
+        state.last_synced = timezone.now()
+        await state.save()
+        return result
+
+    async def loop(self) -> None:
+        while True:
+            try:
+                result = await self.run()
+                logger.info(f"[DirectorySync.loop] {result}")
+            except Exception:
+                logger.exception("[DirectorySync.loop] Directory sync failed")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.http_client.aclose()
+
+
+directory_sync = DirectorySync(
+    endpoint=config.ENTRA_GRAPH_ENDPOINT,
+    token_provider=acquire_graph_token,
+    batch_size=config.DIRECTORY_SYNC_BATCH_SIZE,
+    interval=config.DIRECTORY_SYNC_INTERVAL,
+)
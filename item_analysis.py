@@ -0,0 +1,296 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from uuid import UUID
+
+import model
+import numpy as np
+
+from response_cache import exam_tag, response_cache
+from tortoise.transactions import in_transaction
+
+# Item analysis keeps running sums per template question instead of the attempts
+# themselves. Difficulty and point-biserial discrimination only need n, Σx, Σy, Σy²
+# and Σxy (x = question answered correctly, y = the attempt's total score), so a newly
+# graded attempt is folded in with a few array additions and a view never rescans the
+# response history.
+
+
+@dataclass
+class QuestionStatistics:
+    num_attempts: int
+    difficulty: Optional[float]
+    discrimination: Optional[float]
+    selection_rates: dict[UUID, float]
+
+
+class ItemStatistics:
+    """Running item-analysis sums for the questions and responses of one template"""
+
+    def __init__(self) -> None:
+        self.exam_ids: set[UUID] = set()
+        self.question_index: dict[UUID, int] = {}
+        self.response_index: dict[UUID, int] = {}
+        self.n = np.zeros(0)
+        self.sum_x = np.zeros(0)
+        self.sum_y = np.zeros(0)
+        self.sum_y2 = np.zeros(0)
+        self.sum_xy = np.zeros(0)
+        self.response_question = np.zeros(0, dtype=np.int64)
+        self.response_correct = np.zeros(0, dtype=bool)
+        self.selections = np.zeros(0)
+
+    def _index(self, index: dict[UUID, int], ids: list[UUID]) -> np.ndarray:
+        for id in ids:
+            if id not in index:
+                index[id] = len(index)
+        return np.fromiter((index[id] for id in ids), dtype=np.int64, count=len(ids))
+
+    def _grow(self) -> None:
+        num_questions = len(self.question_index)
+        for name in ("n", "sum_x", "sum_y", "sum_y2", "sum_xy"):
+            values = getattr(self, name)
+            setattr(self, name, np.pad(values, (0, num_questions - len(values))))
+        num_responses = len(self.response_index)
+        for name in ("response_question", "response_correct", "selections"):
+            values = getattr(self, name)
+            setattr(self, name, np.pad(values, (0, num_responses - len(values))))
+
+    def add(
+        self,
+        question_rows: list[tuple[UUID, UUID, UUID]],
+        selection_rows: list[tuple[UUID, UUID]],
+        response_rows: list[tuple[UUID, UUID, bool]],
+    ) -> dict[UUID, float]:
+        """Grades and folds in attempts not seen before, returns their scores
+
+        :param question_rows: (exam question id, exam id, template question id)
+        :param selection_rows: (exam question id, selected template response id)
+        :param response_rows: (template response id, template question id, is correct)
+        """
+        new_rows = [row for row in question_rows if row[1] not in self.exam_ids]
+        if not new_rows:
+            return {}
+        exam_question_ids, exam_ids, question_ids = zip(*new_rows)
+
+        response_ids = [row[0] for row in response_rows]
+        response_questions = self._index(
+            self.question_index, [row[1] for row in response_rows]
+        )
+        questions = self._index(self.question_index, list(question_ids))
+        responses = self._index(self.response_index, response_ids)
+        self._grow()
+        self.response_question[responses] = response_questions
+        self.response_correct[responses] = [row[2] for row in response_rows]
+
+        exam_index: dict[UUID, int] = {}
+        exams = self._index(exam_index, list(exam_ids))
+        row_index = {id: i for i, id in enumerate(exam_question_ids)}
+        selections = [
+            (row_index[exam_question_id], self.response_index[response_id])
+            for exam_question_id, response_id in selection_rows
+            if exam_question_id in row_index and response_id in self.response_index
+        ]
+        selected_rows = np.fromiter(
+            (s[0] for s in selections), dtype=np.int64, count=len(selections)
+        )
+        selected_responses = np.fromiter(
+            (s[1] for s in selections), dtype=np.int64, count=len(selections)
+        )
+
+        # A question is answered correctly when every correct response and nothing else
+        # was selected
+        num_rows = len(new_rows)
+        selected_correct = self.response_correct[selected_responses]
+        hits = np.bincount(selected_rows, weights=selected_correct, minlength=num_rows)
+        misses = np.bincount(
+            selected_rows, weights=~selected_correct, minlength=num_rows
+        )
+        num_correct = np.bincount(
+            self.response_question,
+            weights=self.response_correct,
+            minlength=len(self.question_index),
+        )[questions]
+        x = ((misses == 0) & (hits == num_correct) & (num_correct > 0)).astype(float)
+
+        scores = np.bincount(exams, weights=x) / np.bincount(exams)
+        y = scores[exams]
+
+        num_questions = len(self.question_index)
+        self.n += np.bincount(questions, minlength=num_questions)
+        self.sum_x += np.bincount(questions, weights=x, minlength=num_questions)
+        self.sum_y += np.bincount(questions, weights=y, minlength=num_questions)
+        self.sum_y2 += np.bincount(questions, weights=y * y, minlength=num_questions)
+        self.sum_xy += np.bincount(questions, weights=x * y, minlength=num_questions)
+        self.selections += np.bincount(
+            selected_responses, minlength=len(self.response_index)
+        )
+
+        self.exam_ids.update(exam_index)
+        return {exam_id: float(scores[i]) for exam_id, i in exam_index.items()}
+
+    def question(self, question_id: UUID) -> Optional[QuestionStatistics]:
+        i = self.question_index.get(question_id)
+        if i is None or self.n[i] == 0:
+            return None
+        n, sum_x, sum_y = self.n[i], self.sum_x[i], self.sum_y[i]
+        # Point-biserial correlation is the Pearson correlation with a 0/1 variable
+        variance = (n * sum_x - sum_x**2) * (n * self.sum_y2[i] - sum_y**2)
+        discrimination = None
+        if variance > 0:
+            discrimination = float(
+                (n * self.sum_xy[i] - sum_x * sum_y) / np.sqrt(variance)
+            )
+        return QuestionStatistics(
+            num_attempts=int(n),
+            difficulty=float(sum_x / n),
+            discrimination=discrimination,
+            selection_rates={
+                response_id: float(self.selections[j] / n)
+                for response_id, j in self.response_index.items()
+                if self.response_question[j] == i
+            },
+        )
+
+
+async def fetch_attempts(
+    **filters,
+) -> tuple[dict[UUID, list], dict[UUID, list], dict[UUID, list]]:
+    """Loads graded attempt rows of completed exams, grouped by template
+
+    Filters apply to ExamQuestion, e.g. exam_id__in=... or
+    exam_template_question__exam_template_id=...
+    """
+    question_rows = defaultdict(list)
+    template_ids = {}
+    for (
+        exam_question_id,
+        exam_id,
+        question_id,
+        template_id,
+    ) in await model.ExamQuestion.filter(
+        exam__is_complete=True, exam_template_question_id__isnull=False, **filters
+    ).values_list(
+        "id",
+        "exam_id",
+        "exam_template_question_id",
+        "exam_template_question__exam_template_id",
+    ):
+        question_rows[template_id].append((exam_question_id, exam_id, question_id))
+        template_ids[exam_question_id] = template_id
+
+    selection_rows = defaultdict(list)
+    response_rows = defaultdict(list)
+    if not template_ids:
+        return question_rows, selection_rows, response_rows
+
+    for exam_question_id, response_id in await model.ExamQuestionResponse.filter(
+        exam_question_id__in=list(template_ids),
+        exam_template_question_response_id__isnull=False,
+    ).values_list("exam_question_id", "exam_template_question_response_id"):
+        selection_rows[template_ids[exam_question_id]].append(
+            (exam_question_id, response_id)
+        )
+    for (
+        response_id,
+        question_id,
+        is_correct,
+        template_id,
+    ) in await model.ExamTemplateQuestionResponse.filter(
+        exam_template_question__exam_template_id__in=list(question_rows)
+    ).values_list(
+        "id",
+        "exam_template_question_id",
+        "is_correct",
+        "exam_template_question__exam_template_id",
+    ):
+        response_rows[template_id].append((response_id, question_id, is_correct))
+    return question_rows, selection_rows, response_rows
+
+
+class ItemAnalyzer:
+    """Caches item statistics per template and keeps them current as exams are graded
+
+    The first view of a template scans its history in a task of its own, without
+    blocking grading. Concurrent views share that scan, and attempts graded while it
+    runs are folded in once it finishes.
+    """
+
+    def __init__(self) -> None:
+        self._statistics: dict[UUID, ItemStatistics] = {}
+        self._scans: dict[UUID, asyncio.Task] = {}
+        self._pending: dict[UUID, list[tuple[list, list, list]]] = {}
+        self._stale: set[UUID] = set()
+
+    async def get(self, exam_template_id: UUID) -> ItemStatistics:
+        """Returns the template's statistics, scanning its history on first use only"""
+        statistics = self._statistics.get(exam_template_id)
+        if statistics is not None:
+            return statistics
+        scan = self._scans.get(exam_template_id)
+        if scan is None:
+            scan = asyncio.create_task(self._scan(exam_template_id))
+            self._scans[exam_template_id] = scan
+        # A viewer leaving must not cancel the scan the others are waiting on
+        return await asyncio.shield(scan)
+
+    async def _scan(self, exam_template_id: UUID) -> ItemStatistics:
+        self._pending[exam_template_id] = []
+        try:
+            question_rows, selection_rows, response_rows = await fetch_attempts(
+                exam_template_question__exam_template_id=exam_template_id
+            )
+            statistics = ItemStatistics()
+            statistics.add(
+                question_rows[exam_template_id],
+                selection_rows[exam_template_id],
+                response_rows[exam_template_id],
+            )
+            # Attempts the scan already counted are skipped
+            for attempts in self._pending[exam_template_id]:
+                statistics.add(*attempts)
+            if exam_template_id not in self._stale:
+                self._statistics[exam_template_id] = statistics
+            return statistics
+        finally:
+            del self._pending[exam_template_id]
+            del self._scans[exam_template_id]
+            self._stale.discard(exam_template_id)
+
+    def forget(self, exam_template_ids: Iterable[UUID]) -> None:
+        """Drops cached statistics, e.g. after their attempts left the live tables"""
+        for exam_template_id in exam_template_ids:
+            self._statistics.pop(exam_template_id, None)
+            # A scan in progress may have read the attempts before they left
+            if exam_template_id in self._scans:
+                self._stale.add(exam_template_id)
+
+    async def grade(self, exam_ids: list[UUID]) -> None:
+        """Scores newly completed exams and folds them into the cached statistics"""
+        question_rows, selection_rows, response_rows = await fetch_attempts(
+            exam_id__in=exam_ids
+        )
+        scores = {}
+        for template_id, rows in question_rows.items():
+            attempts = (rows, selection_rows[template_id], response_rows[template_id])
+            scores.update(ItemStatistics().add(*attempts))
+            # Templates nobody has looked at yet are scanned in full on first view
+            statistics = self._statistics.get(template_id)
+            if statistics is not None:
+                statistics.add(*attempts)
+            elif template_id in self._pending:
+                self._pending[template_id].append(attempts)
+        async with in_transaction():
+            for exam_id, score in scores.items():
+                await model.Exam.filter(id=exam_id).update(score=score)
+        response_cache.invalidate(*map(exam_tag, scores))
+
+
+item_analyzer = ItemAnalyzer()
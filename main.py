@@ -1,12 +1,21 @@
 from nicegui import app, ui
 from tortoise import Tortoise
 
+from archive import exam_archiver
+from directory_sync import directory_sync
+from migrations import migrate_schema
 from pages import *
+from proctoring import proctor_hub
+from response_cache import response_cache
+from scheduler import deadline_scheduler
+from search import create_question_search_index
 
 
 async def init_db() -> None:
     await Tortoise.init(db_url="sqlite://db.sqlite3", modules={"model": ["model"]})
+    await migrate_schema()
     await Tortoise.generate_schemas()
+    await create_question_search_index()
 
 
 async def deinit_db() -> None:
@@ -15,6 +24,16 @@ async def deinit_db() -> None:
 
 def main() -> None:
     app.on_startup(init_db)
+    app.on_startup(response_cache.subscribe)
+    app.on_startup(proctor_hub.start)
+    app.on_startup(deadline_scheduler.start)
+    app.on_startup(directory_sync.start)
+    app.on_startup(exam_archiver.start)
+    app.on_shutdown(exam_archiver.stop)
+    app.on_shutdown(directory_sync.stop)
+    app.on_shutdown(deadline_scheduler.stop)
+    app.on_shutdown(proctor_hub.stop)
+    app.on_shutdown(response_cache.unsubscribe)
     app.on_shutdown(deinit_db)
     ui.run(
         title="KFN Exam Platform",
@@ -0,0 +1,67 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import logging
+
+from tortoise import Tortoise
+
+logger = logging.getLogger(__name__)
+
+# generate_schemas() only creates missing tables, so columns added to existing models
+# are added here. Each is added only if its table exists without it, which makes the
+# migration safe to run on every startup. It has to run before generate_schemas(),
+# whose index statements would otherwise fail on the missing columns.
+
+COLUMNS: list[tuple[str, str, str]] = [
+    ("user", "object_id", "VARCHAR(36)"),
+    ("user", "is_active", "INT NOT NULL DEFAULT 1"),
+    ("exam", "time_limit", "INT"),
+    ("exam", "started", "TIMESTAMP"),
+    ("exam", "deadline", "TIMESTAMP"),
+    ("exam", "completed", "TIMESTAMP"),
+    ("exam", "score", "REAL"),
+    ("examtemplate", "version", "INT NOT NULL DEFAULT 1"),
+    ("examtemplate", "time_limit", "INT"),
+    ("examtemplatequestion", "version", "INT NOT NULL DEFAULT 1"),
+    ("examtemplatequestionresponse", "version", "INT NOT NULL DEFAULT 1"),
+    (
+        "examquestion",
+        "exam_template_question_id",
+        'CHAR(36) REFERENCES "examtemplatequestion" ("id") ON DELETE SET NULL',
+    ),
+    (
+        "examquestionresponse",
+        "exam_template_question_response_id",
+        'CHAR(36) REFERENCES "examtemplatequestionresponse" ("id") ON DELETE SET NULL',
+    ),
+]
+
+# SQLite cannot add a UNIQUE column, the constraint is added as a unique index instead
+UNIQUE_COLUMNS: set[tuple[str, str]] = {("user", "object_id")}
+
+
+async def migrate_schema() -> None:
+    """Adds the columns missing from tables created by an older schema"""
+    connection = Tortoise.get_connection("default")
+    _, tables = await connection.execute_query(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    )
+    existing = {table["name"] for table in tables}
+    for table, column, definition in COLUMNS:
+        if table not in existing:
+            continue
+        _, columns = await connection.execute_query(f'PRAGMA table_info("{table}")')
+        if column in {c["name"] for c in columns}:
+            continue
+        logger.info(f"[migrate_schema] Adding {table}.{column}")
+        await connection.execute_script(
+            f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}'
+        )
+        if (table, column) in UNIQUE_COLUMNS:
+            await connection.execute_script(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS "uid_{table}_{column}" '
+                f'ON "{table}" ("{column}")'
+            )
@@ -8,7 +8,18 @@ class User(models.Model):
     id = fields.UUIDField(pk=True)
     name = fields.TextField()
     email = fields.TextField()
+    object_id = fields.CharField(
+        max_length=36, null=True, unique=True, description="Entra directory object id"
+    )
+    is_active = fields.BooleanField(default=True)
     exams: fields.ReverseRelation["Exam"]
+    archived_exams: fields.ReverseRelation["ArchivedExam"]
+
+
+class DirectorySyncState(models.Model):
+    id = fields.IntField(pk=True)
+    delta_link = fields.TextField(null=True)
+    last_synced = fields.DatetimeField(null=True)
 
 
 class Exam(models.Model):
@@ -19,6 +30,11 @@ class Exam(models.Model):
     name = fields.TextField()
     questions: fields.ReverseRelation["ExamQuestion"]
     is_complete = fields.BooleanField()
+    time_limit = fields.IntField(null=True, description="Time limit in minutes")
+    started = fields.DatetimeField(null=True)
+    deadline = fields.DatetimeField(null=True, index=True)
+    completed = fields.DatetimeField(null=True)
+    score = fields.FloatField(null=True)
 
     def num_questions(self) -> int:
         try:
@@ -40,6 +56,14 @@ class ExamQuestion(models.Model):
     )
     type: QuestionType = fields.IntEnumField(enum_type=QuestionType)
     body = fields.TextField()
+    exam_template_question: fields.ForeignKeyNullableRelation[
+        "ExamTemplateQuestion"
+    ] = fields.ForeignKeyField(
+        model_name="model.ExamTemplateQuestion",
+        related_name="exam_questions",
+        null=True,
+        on_delete=fields.SET_NULL,
+    )
     response: fields.ReverseRelation["ExamQuestionResponse"]
 
     def is_complete(self) -> bool:
@@ -54,15 +78,42 @@ class ExamQuestionResponse(models.Model):
     exam_question: fields.ForeignKeyRelation[ExamQuestion] = fields.ForeignKeyField(
         model_name="model.ExamQuestion", related_name="response"
     )
+    exam_template_question_response: fields.ForeignKeyNullableRelation[
+        "ExamTemplateQuestionResponse"
+    ] = fields.ForeignKeyField(
+        model_name="model.ExamTemplateQuestionResponse",
+        related_name="selections",
+        null=True,
+        on_delete=fields.SET_NULL,
+    )
     submitted_datetime = fields.DatetimeField(auto_now=True)
     is_submitted = fields.BooleanField()
 
 
+class ArchivedExam(models.Model):
+    id = fields.UUIDField(pk=True)
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        model_name="model.User", related_name="archived_exams"
+    )
+    name = fields.TextField()
+    time_limit = fields.IntField(null=True, description="Time limit in minutes")
+    started = fields.DatetimeField(null=True)
+    completed = fields.DatetimeField(null=True)
+    score = fields.FloatField(null=True)
+    num_questions = fields.IntField()
+    archived = fields.DatetimeField(auto_now_add=True)
+    payload = fields.BinaryField(
+        description="zlib-compressed JSON of the exam's questions and responses"
+    )
+
+
 class ExamTemplate(models.Model):
     id = fields.UUIDField(pk=True)
     name = fields.TextField()
     created = fields.DatetimeField(auto_now_add=True)
     updated = fields.DatetimeField(auto_now=True)
+    version = fields.IntField(default=1)
+    time_limit = fields.IntField(null=True, description="Time limit in minutes")
 
     author: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
         model_name="model.User", related_name="authored_exam_templates"
@@ -86,6 +137,7 @@ class ExamTemplateQuestion(models.Model):
     )
     type = fields.IntEnumField(enum_type=QuestionType)
     body = fields.TextField()
+    version = fields.IntField(default=1)
     responses: fields.ReverseRelation["ExamTemplateQuestionResponse"]
 
 
@@ -98,3 +150,4 @@ class ExamTemplateQuestionResponse(models.Model):
     )
     value = fields.TextField()
     is_correct = fields.BooleanField()
+    version = fields.IntField(default=1)
@@ -1,4 +1,6 @@
-from typing import List
+from dataclasses import asdict
+from datetime import datetime
+from typing import List, Optional
 from uuid import UUID
 
 import config
@@ -10,22 +12,34 @@ import msal
 import requests
 
 from admin.exam_template import ExamTemplate
+from admin.exam_template_io import (
+    export_templates,
+    import_templates,
+    read_json_lines,
+    read_yaml_documents,
+    TemplateImportError,
+)
+from archive import exam_results, rehydrate_exam
+from broadcast import get_broadcaster
 from cachetools import TTLCache
-from fastapi import Request
-from fastapi.responses import RedirectResponse
+from fastapi import Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from jwt.algorithms import RSAAlgorithm
-from nicegui import app, Client, ui
+from nicegui import app, Client, context, events, ui
+from proctoring import proctor_hub, PROCTOR_TOPIC
+from response_cache import exam_tag, exam_template_tag, response_cache, user_tag
+from scheduler import complete_exams, deadline_scheduler, start_exam
+from search import search_questions
 
 from style import Frame, TextLabel
+from tortoise import timezone
+from tortoise.functions import Count
+from tortoise.transactions import in_transaction
+from user import sign_in, User
 
 ALL_PAGES: frozenset[tuple[str, str]] = [["Home", "/"], ["Take Exam", "/exam"]]
 
-TEST_RESULTS: frozenset[tuple[str, bool]] = [
-    ["MPLS Fundamentals", True],
-    ["MPLS L2VPN Troubleshooting", False],
-]
-
 INPROGRESS_AUTH_FLOW_CACHE = TTLCache(maxsize=10, ttl=60 * 5)
 USER_CACHE = TTLCache(maxsize=100, ttl=60 * 60 * 10)
 
@@ -101,12 +115,11 @@ async def oauth_redirect_page(client: Client) -> None:
     if not claims:
         ui.label(f"Error during Entra AD authentication - Invalid ID token: {id_token}")
         return
+    if await sign_in(claims) is None:
+        ui.label("Your account has been disabled, please contact an administrator")
+        return
     USER_CACHE[browser_id] = claims
-
-    name = app.storage.user["user"]["name"]
-    email = app.storage.user["user"]["preferred_username"]
-
-    await model.User.get_or_create(name=name, email=email)
+    app.storage.user["user"] = claims
 
     ui.navigate.to(app.storage.user["previous_url"])
 
@@ -129,13 +142,16 @@ def logout_page(request: Request):
 @ui.page("/")
 async def index_page(request: Request) -> None:
     with Frame("Home", request):
-        TextLabel("Your assigned exams: ").classes("font-bold")
+        TextLabel("Your exam results: ").classes("font-bold")
         ui.separator()
+        results = []
+        if "user" in app.storage.user:
+            results = await exam_results((await User.get_active()).id)
         with ui.grid(columns=3):
-            for result in TEST_RESULTS:
-                TextLabel(result[0])
+            for result in results:
+                ui.link(result.name, f"/exam/{result.id}")
                 TextLabel("Result: ")
-                TextLabel("PASS" if result[1] else "FAIL")
+                TextLabel("-" if result.score is None else f"{result.score:.0%}")
 
 
 @ui.page("/exam")
@@ -147,53 +163,166 @@ async def exam_index_page(request: Request) -> None:
 
 @ui.page("/exam/{id}")
 async def exam_page(id: UUID, request: Request) -> None:
-    async def start_exam(exam: model.Exam):
+    async def start(exam: model.Exam):
         print(f"Starting exam: {exam.name}")
+        await start_exam(exam)
         first_question = await exam.questions.all().first().prefetch_related("response")
         ui.navigate.to(f"/exam/{exam.id}/question/{first_question.id}")
 
-    with await model.Exam.get(id=id).prefetch_related("questions") as exam:
-        with Frame(f"Exam: {exam.name}", request):
-            with ui.card():
+    if not await model.Exam.exists(id=id):
+        await rehydrate_exam(id)
+    exam = await model.Exam.get(id=id).prefetch_related("questions")
+    with Frame(f"Exam: {exam.name}", request):
+        with ui.card():
+            if exam.time_limit:
                 with ui.row().classes("items-center"):
-                    TextLabel(f"Press to start exam: ")
-                    ui.button(icon="play", on_click=lambda e=exam: start_exam(e)).props(
-                        "flat"
-                    )
+                    TextLabel(f"Time limit: {exam.time_limit} minutes")
+            with ui.row().classes("items-center"):
+                TextLabel(f"Press to start exam: ")
+                ui.button(icon="play", on_click=lambda e=exam: start(e)).props(
+                    "flat"
+                )
 
 
 @ui.page("/exam/{exam_id}/question/{question_id}")
 async def exam_question_page(
     exam_id: UUID, question_id: UUID, request: Request
 ) -> None:
-    with await model.ExamQuestion.get(
-        id=question_id
-    ) as exam_question, await model.Exam.get(id=exam_id) as exam:
-        with Frame(f"Exam: {exam.name} - Question {question_id}", request):
-            with ui.card():
-                with ui.row().classes("items-center"):
-                    ui.markdown().bind_content_from(exam_question, "body")
+    async def save_answer(selected: List[UUID]) -> None:
+        if exam.deadline is not None and timezone.now() > exam.deadline:
+            ui.notify("The time limit for this exam has passed", type="warning")
+            return
+        async with in_transaction():
+            # The exam may have been submitted from another tab or by the scheduler
+            # since this page was loaded
+            if not await model.Exam.filter(id=exam.id, is_complete=False).exists():
+                ui.notify("This exam has been submitted", type="warning")
+                return
+            await model.ExamQuestionResponse.filter(
+                exam_question_id=exam_question.id
+            ).delete()
+            await model.ExamQuestionResponse.bulk_create(
+                [
+                    model.ExamQuestionResponse(
+                        exam_question_id=exam_question.id,
+                        exam_template_question_response_id=response_id,
+                        is_submitted=False,
+                    )
+                    for response_id in selected
+                ]
+            )
+        proctor_hub.answer_saved(exam, exam_question.id, len(selected) > 0)
+
+    async def submit_exam() -> None:
+        deadline_scheduler.cancel(exam.id)
+        await complete_exams([exam.id])
+        ui.navigate.to("/")
+
+    if not await model.Exam.exists(id=exam_id):
+        await rehydrate_exam(exam_id)
+    exam = await model.Exam.get(id=exam_id).prefetch_related("user", "questions")
+    if not exam.is_complete:
+        # A candidate following a link straight to a question still starts the clock
+        await start_exam(exam)
+    exam_question = await model.ExamQuestion.get(
+        id=question_id, exam_id=exam_id
+    ).prefetch_related("response", "exam_template_question__responses")
+    questions: List[model.ExamQuestion] = list(exam.questions)
+    question_index = next(i for i, q in enumerate(questions) if q.id == question_id)
+    proctor_hub.question_viewed(exam, question_index + 1)
+    single_select = model.QuestionType.MULTIPLE_CHOICE_SINGLE_SELECT
+
+    def question_url(index: int) -> str:
+        return f"/exam/{exam.id}/question/{questions[index].id}"
+
+    deadline_label: Optional[ui.label] = None
+    with Frame(f"Exam: {exam.name} - Question {question_index + 1}", request):
+        with ui.card():
+            if exam.deadline is not None and not exam.is_complete:
                 with ui.row().classes("items-center"):
+                    deadline_label = ui.label(
+                        f"Time is up at {exam.deadline.astimezone():%H:%M}"
+                    )
+            with ui.row().classes("items-center"):
+                ui.markdown().bind_content_from(exam_question, "body")
+            with ui.row().classes("items-center"):
+                template_question = exam_question.exam_template_question
+                selected = [
+                    r.exam_template_question_response_id for r in exam_question.response
+                ]
+                if exam.is_complete:
+                    TextLabel("This exam has been submitted")
+                elif exam.deadline is not None and timezone.now() > exam.deadline:
+                    TextLabel("The time limit for this exam has passed")
+                elif template_question is None:
                     ui.editor(placeholder="Answer")
+                elif exam_question.type == single_select:
+                    ui.radio(
+                        {r.id: r.value for r in template_question.responses},
+                        value=selected[0] if selected else None,
+                        on_change=lambda e: save_answer([e.value] if e.value else []),
+                    )
+                else:
+                    ui.select(
+                        {r.id: r.value for r in template_question.responses},
+                        multiple=True,
+                        value=selected,
+                        label="Answer",
+                        on_change=lambda e: save_answer(e.value or []),
+                    )
+            with ui.card_actions():
+                if question_index > 0:
+                    ui.button(
+                        icon="navigate_before",
+                        on_click=lambda: ui.navigate.to(
+                            question_url(question_index - 1)
+                        ),
+                    ).props("flat")
+                if question_index < len(questions) - 1:
+                    ui.button(
+                        icon="navigate_next",
+                        on_click=lambda: ui.navigate.to(
+                            question_url(question_index + 1)
+                        ),
+                    ).props("flat")
+                elif not exam.is_complete:
+                    ui.button("Submit Exam", on_click=submit_exam)
+
+    if deadline_label is not None:
+        # The deadline is stored in UTC, show it in the candidate's own time zone
+        try:
+            await context.client.connected()
+            deadline = await ui.run_javascript(
+                f"new Date('{exam.deadline.isoformat()}')"
+                ".toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'})"
+            )
+        except TimeoutError:
+            return
+        deadline_label.set_text(f"Time is up at {deadline}")
 
 
 @ui.refreshable
 async def list_of_users(request: Request) -> None:
     async def delete(user: model.User) -> None:
         await user.delete()
+        response_cache.invalidate(user_tag(user.id))
         list_of_users.refresh()
 
+    async def save(user: model.User) -> None:
+        await user.save()
+        response_cache.invalidate(user_tag(user.id))
+
     users: List[model.User] = await model.User.all()
     with Frame("Users", request):
         for user in reversed(users):
             with ui.card():
                 with ui.row().classes("items-center"):
-                    ui.input("Name", on_change=user.save).bind_value(user, "name").on(
-                        "blur", list_of_users.refresh
-                    )
-                    ui.input("Email", on_change=user.save).bind_value(user, "email").on(
-                        "blur", list_of_users.refresh
-                    )
+                    ui.input(
+                        "Name", on_change=lambda _, u=user: save(u)
+                    ).bind_value(user, "name").on("blur", list_of_users.refresh)
+                    ui.input(
+                        "Email", on_change=lambda _, u=user: save(u)
+                    ).bind_value(user, "email").on("blur", list_of_users.refresh)
                     ui.button(icon="delete", on_click=lambda u=user: delete(u)).props(
                         "flat"
                     )
@@ -224,6 +353,9 @@ async def list_of_active_exams(request: Request) -> None:
         # TODO: do we want to actually delete it? Or just flag it as cancelled?
 
         await exam.delete()
+        response_cache.invalidate(exam_tag(exam.id))
+        deadline_scheduler.cancel(exam.id)
+        proctor_hub.exam_removed(exam.id)
         list_of_active_exams.refresh()
 
     active_exams: List[model.Exam] = await model.Exam.filter(
@@ -244,15 +376,24 @@ async def list_of_active_exams(request: Request) -> None:
 async def admin_exam_page(request: Request) -> None:
     async def assign_exam_to_user() -> None:
         exam: model.Exam = await model.Exam.create(
-            user=user.value, name=exam_template.value, is_complete=False
+            user=user.value,
+            name=exam_template.value,
+            is_complete=False,
+            time_limit=exam_template.value.time_limit,
         )
         for exam_question in exam_template.value.questions:
             await model.ExamQuestion.create(
-                exam=exam, type=exam_question.type, body=exam_question.body
+                exam=exam,
+                type=exam_question.type,
+                body=exam_question.body,
+                exam_template_question=exam_question,
             )
+        await exam.fetch_related("user", "questions")
+        response_cache.invalidate(user_tag(exam.user.id))
+        proctor_hub.exam_assigned(exam)
         list_of_active_exams.refresh()
 
-    all_users: List[model.User] = await model.User.all()
+    all_users: List[model.User] = await model.User.filter(is_active=True)
     all_exam_templates: List[model.ExamTemplate] = (
         await model.ExamTemplate.all().prefetch_related("questions")
     )
@@ -271,13 +412,57 @@ async def admin_exam_page(request: Request) -> None:
             await list_of_active_exams(request)
 
 
+@app.get("/api/exam/template/export")
+async def export_exam_templates_api(format: str = "jsonl") -> StreamingResponse:
+    extension = "yaml" if format == "yaml" else "jsonl"
+    return StreamingResponse(
+        export_templates(extension),
+        media_type="application/yaml" if format == "yaml" else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f"attachment; filename=exam_templates.{extension}"
+        },
+    )
+
+
 @ui.page("/admin/exam/template")
 async def admin_exam_template_page(request: Request) -> None:
+    async def import_exam_templates(e: events.UploadEventArguments) -> None:
+        if e.name.endswith((".yaml", ".yml")):
+            documents = read_yaml_documents(e.content)
+        else:
+            documents = read_json_lines(e.content)
+        try:
+            imported = await import_templates(documents, await User.get_active())
+        except TemplateImportError as error:
+            ui.notify(
+                f"Import stopped at {error}. "
+                f"{error.imported} exam templates before it were imported",
+                type="negative",
+            )
+            if error.imported:
+                ui.navigate.reload()
+            return
+        ui.notify(f"Imported {imported} exam templates", type="positive")
+        ui.navigate.reload()
+
     with Frame("Admin - Exam Template", request):
         with ui.card().classes("absolute-center items-center w-full"):
             new_exam_template = ExamTemplate(id=None, name=None)
             await new_exam_template.create()
 
+            with ui.card():
+                with ui.row().classes("items-center"):
+                    ui.upload(
+                        label="Import (.jsonl, .yaml)",
+                        auto_upload=True,
+                        on_upload=import_exam_templates,
+                    ).props("accept=.jsonl,.json,.yaml,.yml flat")
+                    ui.button(
+                        "Export",
+                        icon="download",
+                        on_click=lambda: ui.download("/api/exam/template/export"),
+                    ).props("flat")
+
             for exam_template in await model.ExamTemplate.all().prefetch_related(
                 "questions",
                 "questions__responses",
@@ -287,6 +472,124 @@ async def admin_exam_template_page(request: Request) -> None:
                 await (await ExamTemplate.load(exam_template)).summary()
 
 
+@app.get("/api/search/questions")
+async def search_questions_api(q: str, limit: int = 20) -> List[dict]:
+    limit = max(1, min(limit, 100))
+    return [asdict(result) for result in await search_questions(q, limit)]
+
+
+EXAM_API_FIELDS = (
+    "id",
+    "name",
+    "is_complete",
+    "time_limit",
+    "started",
+    "deadline",
+    "completed",
+    "score",
+)
+
+
+@app.get("/api/user/{user_id}/exams")
+async def user_exams_api(user_id: UUID, request: Request) -> Response:
+    async def load() -> tuple[List[dict], List[str]]:
+        exams = (
+            await model.Exam.filter(user_id=user_id)
+            .annotate(num_questions=Count("questions"))
+            .group_by("id")
+            .values(*EXAM_API_FIELDS, "num_questions")
+        )
+        for exam in exams:
+            exam["is_archived"] = False
+        # Archived exams only keep their summary columns, all of them are complete
+        for exam in await model.ArchivedExam.filter(user_id=user_id).values(
+            "id", "name", "time_limit", "started", "completed", "score", "num_questions"
+        ):
+            exams.append(
+                exam | {"is_complete": True, "deadline": None, "is_archived": True}
+            )
+        return exams, [user_tag(user_id), *(exam_tag(exam["id"]) for exam in exams)]
+
+    return await response_cache.respond(request, f"user_exams:{user_id}", load)
+
+
+@app.get("/api/exam/{exam_id}")
+async def exam_api(exam_id: UUID, request: Request) -> Response:
+    async def load() -> Optional[tuple[dict, List[str]]]:
+        exam = await model.Exam.filter(id=exam_id).first().values(*EXAM_API_FIELDS)
+        if exam is None:
+            return None
+        exam["questions"] = await model.ExamQuestion.filter(exam_id=exam_id).values(
+            "id", "type", "body"
+        )
+        return exam, [exam_tag(exam_id)]
+
+    return await response_cache.respond(request, f"exam:{exam_id}", load)
+
+
+@app.get("/api/exam/template/{exam_template_id}")
+async def exam_template_api(exam_template_id: UUID, request: Request) -> Response:
+    async def load() -> Optional[tuple[dict, List[str]]]:
+        exam_template = (
+            await model.ExamTemplate.filter(id=exam_template_id)
+            .annotate(num_questions=Count("questions"))
+            .group_by("id")
+            .first()
+            .values(
+                "id",
+                "name",
+                "version",
+                "time_limit",
+                "created",
+                "updated",
+                "num_questions",
+                "author_id",
+                "updated_by_id",
+                author="author__name",
+                updated_by="updated_by__name",
+            )
+        )
+        if exam_template is None:
+            return None
+        # Tagged with both users, so renaming either one drops the cached names
+        tags = [
+            exam_template_tag(exam_template_id),
+            user_tag(exam_template.pop("author_id")),
+            user_tag(exam_template.pop("updated_by_id")),
+        ]
+        return exam_template, tags
+
+    return await response_cache.respond(
+        request, f"exam_template:{exam_template_id}", load
+    )
+
+
+@ui.page("/admin/exam/search")
+async def admin_question_search_page(request: Request) -> None:
+    @ui.refreshable
+    async def results(query: str) -> None:
+        for result in await search_questions(query):
+            with ui.card().classes("w-full"):
+                with ui.row().classes("w-full items-center"):
+                    ui.label(result.exam_template_name).classes("font-bold")
+                    ui.button(
+                        icon="edit",
+                        on_click=lambda r=result: ui.navigate.to(
+                            f"/admin/exam/template/{r.exam_template_id}"
+                        ),
+                    ).props("flat").classes("ml-auto")
+                ui.html(result.body_snippet)
+                if "<b>" in result.responses_snippet:
+                    ui.html(result.responses_snippet).classes("text-grey-8")
+
+    with Frame("Admin - Search Questions", request):
+        with ui.column().classes("mx-auto w-full"):
+            ui.input(
+                label="Search questions", on_change=lambda e: results.refresh(e.value)
+            ).props("debounce=300 clearable").classes("w-full")
+            await results("")
+
+
 @ui.page("/admin/exam/template/{id}")
 async def admin_edit_exam_template_page(id: UUID, request: Request) -> None:
     with Frame("Admin - Edit Exam Template", request):
@@ -299,3 +602,58 @@ async def admin_edit_exam_template_page(id: UUID, request: Request) -> None:
             )
         )
         await exam_template.edit()
+
+
+@ui.page("/admin/exam/proctor")
+async def admin_proctor_page(request: Request) -> None:
+    # Rows are keyed by exam and only updated from pushed activity, never re-queried
+    rows: dict[str, dict[str, ui.label]] = {}
+
+    def show_activity(activity: dict) -> None:
+        row = rows.get(activity["exam_id"])
+        if activity["is_removed"]:
+            if row is not None:
+                row["card"].delete()
+                del rows[activity["exam_id"]]
+            return
+        if row is None:
+            with activity_column:
+                with ui.card() as card:
+                    with ui.row().classes("items-center"):
+                        row = {
+                            "card": card,
+                            "user_name": ui.label(),
+                            "exam_name": ui.label(),
+                            "progress": ui.label(),
+                            "status": ui.label(),
+                        }
+            rows[activity["exam_id"]] = row
+        row["user_name"].set_text(activity["user_name"])
+        row["exam_name"].set_text(activity["exam_name"])
+        current_question = activity["current_question"]
+        num_questions = activity["num_questions"]
+        num_answered = activity["num_answered"]
+        row["progress"].set_text(
+            f"Question {current_question} / {num_questions} - Answered {num_answered}"
+        )
+        last_activity = activity["last_activity"]
+        if activity["is_complete"]:
+            row["status"].set_text("Submitted")
+        elif last_activity is not None:
+            last_activity = datetime.fromisoformat(last_activity).astimezone()
+            row["status"].set_text(f"Last activity: {last_activity:%H:%M:%S}")
+
+    client = context.client
+
+    def on_push(message: dict) -> None:
+        with client:
+            for activity in message["activities"]:
+                show_activity(activity)
+
+    with Frame("Proctor Dashboard", request):
+        with ui.column().classes("mx-auto") as activity_column:
+            for activity in proctor_hub.snapshot():
+                show_activity(activity)
+
+    get_broadcaster().subscribe(PROCTOR_TOPIC, on_push)
+    client.on_disconnect(lambda: get_broadcaster().unsubscribe(PROCTOR_TOPIC, on_push))
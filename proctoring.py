@@ -0,0 +1,183 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+import config
+import model
+
+from broadcast import get_broadcaster, Message
+from tortoise import timezone
+
+logger = logging.getLogger(__name__)
+
+PROCTOR_TOPIC = "proctor"
+
+
+@dataclass
+class ExamActivity:
+    """In-memory aggregate of what a candidate is doing in one exam"""
+
+    exam_id: UUID
+    exam_name: str
+    user_name: str
+    num_questions: int
+    answered: set[UUID] = field(default_factory=set)
+    current_question: int = 0
+    is_complete: bool = False
+    is_removed: bool = False
+    last_activity: Optional[datetime] = None
+
+    def to_message(self) -> Message:
+        return {
+            "exam_id": str(self.exam_id),
+            "exam_name": self.exam_name,
+            "user_name": self.user_name,
+            "num_questions": self.num_questions,
+            "num_answered": len(self.answered),
+            "current_question": self.current_question,
+            "is_complete": self.is_complete,
+            "is_removed": self.is_removed,
+            "last_activity": (
+                self.last_activity.isoformat() if self.last_activity else None
+            ),
+        }
+
+
+class ProctorHub:
+    """Aggregates exam events in memory and pushes changed exams to proctors
+
+    Events only touch the exam's aggregate and mark it dirty. A single loop publishes
+    the dirty aggregates at most once per push interval, so a push costs in proportion
+    to the exams that changed rather than to the number of active candidates. The
+    database is only read once, at startup.
+    """
+
+    def __init__(self, push_interval: float) -> None:
+        self.push_interval = push_interval
+        self._activities: dict[UUID, ExamActivity] = {}
+        self._dirty: set[UUID] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def snapshot(self) -> list[Message]:
+        return [activity.to_message() for activity in self._activities.values()]
+
+    def _touch(self, activity: ExamActivity) -> None:
+        activity.last_activity = timezone.now()
+        self._dirty.add(activity.exam_id)
+
+    def _activity(self, exam: model.Exam) -> ExamActivity:
+        """Returns the exam's aggregate, exam.user and exam.questions must be fetched"""
+        activity = self._activities.get(exam.id)
+        if activity is None:
+            activity = ExamActivity(
+                exam_id=exam.id,
+                exam_name=exam.name,
+                user_name=exam.user.name,
+                num_questions=exam.num_questions(),
+                is_complete=exam.is_complete,
+            )
+            self._activities[exam.id] = activity
+        return activity
+
+    def exam_assigned(self, exam: model.Exam) -> None:
+        self._touch(self._activity(exam))
+
+    def exam_removed(self, exam_id: UUID) -> None:
+        activity = self._activities.get(exam_id)
+        if activity is not None:
+            activity.is_removed = True
+            self._touch(activity)
+
+    def _active(self, exam: model.Exam) -> Optional[ExamActivity]:
+        """Returns the aggregate of an exam in progress, None once it has finished
+
+        Every exam in progress is tracked from load() or exam_assigned(), so candidates
+        revisiting a completed or rehydrated exam never bring its aggregate back.
+        """
+        activity = self._activities.get(exam.id)
+        if activity is None or activity.is_complete or activity.is_removed:
+            return None
+        return activity
+
+    def question_viewed(self, exam: model.Exam, question_number: int) -> None:
+        activity = self._active(exam)
+        if activity is None:
+            return
+        activity.current_question = question_number
+        self._touch(activity)
+
+    def answer_saved(
+        self, exam: model.Exam, exam_question_id: UUID, is_answered: bool
+    ) -> None:
+        activity = self._active(exam)
+        if activity is None:
+            return
+        if is_answered:
+            activity.answered.add(exam_question_id)
+        else:
+            activity.answered.discard(exam_question_id)
+        self._touch(activity)
+
+    def exams_completed(self, exam_ids: list[UUID]) -> None:
+        for exam_id in exam_ids:
+            activity = self._activities.get(exam_id)
+            if activity is not None:
+                activity.is_complete = True
+                self._touch(activity)
+
+    async def load(self) -> None:
+        """Seeds the aggregates for every exam still in progress"""
+        for exam in await model.Exam.filter(is_complete=False).prefetch_related(
+            "user", "questions"
+        ):
+            self._activity(exam)
+        for exam_id, exam_question_id in await model.ExamQuestionResponse.filter(
+            exam_question__exam__is_complete=False
+        ).values_list("exam_question__exam_id", "exam_question_id"):
+            activity = self._activities.get(exam_id)
+            if activity is not None:
+                activity.answered.add(exam_question_id)
+
+    async def push(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        activities = []
+        for exam_id in dirty:
+            activity = self._activities.get(exam_id)
+            if activity is None:
+                continue
+            activities.append(activity.to_message())
+            # Finished exams are pushed one last time and then forgotten
+            if activity.is_complete or activity.is_removed:
+                del self._activities[exam_id]
+        await get_broadcaster().publish(PROCTOR_TOPIC, {"activities": activities})
+
+    async def loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.push_interval)
+            try:
+                await self.push()
+            except Exception:
+                logger.exception("[ProctorHub.loop] Failed to push exam activity")
+
+    async def start(self) -> None:
+        await self.load()
+        self._task = asyncio.create_task(self.loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+proctor_hub = ProctorHub(push_interval=config.PROCTOR_PUSH_INTERVAL)
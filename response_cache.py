@@ -0,0 +1,167 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Any, Awaitable, Callable, Iterable, Optional
+from uuid import UUID, uuid4
+
+import config
+import orjson
+
+from broadcast import get_broadcaster, Message
+from cachetools import LRUCache
+from fastapi import HTTPException, Request, Response
+
+# Read-only API responses are cached as serialized bodies with an ETag hashed from their
+# content. A conditional GET whose If-None-Match still matches is answered 304 straight
+# from memory, so polling clients never reach the ORM. Entries are tagged with the rows
+# they were built from, and write paths drop them with invalidate() by those tags.
+#
+# Every worker keeps its own cache, so invalidate() also publishes the tags on the
+# broadcaster and each worker drops them from its copy. With the default in-process
+# broadcaster this only covers a single worker; running several needs a broker-backed
+# broadcaster set before startup.
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_TOPIC = "response_cache"
+
+Loader = Callable[[], Awaitable[Optional[tuple[Any, Iterable[str]]]]]
+
+
+def exam_tag(exam_id: UUID) -> str:
+    return f"exam:{exam_id}"
+
+
+def user_tag(user_id: UUID) -> str:
+    return f"user:{user_id}"
+
+
+def exam_template_tag(exam_template_id: UUID) -> str:
+    return f"exam_template:{exam_template_id}"
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    body: bytes
+    tags: tuple[str, ...]
+
+
+class EvictingLRUCache(LRUCache):
+    """LRUCache that reports the entries it evicts to make room"""
+
+    def __init__(
+        self, maxsize: int, on_evict: Callable[[str, CachedResponse], None]
+    ) -> None:
+        super().__init__(maxsize=maxsize)
+        self.on_evict = on_evict
+
+    def popitem(self) -> tuple[str, CachedResponse]:
+        key, entry = super().popitem()
+        self.on_evict(key, entry)
+        return key, entry
+
+
+class ResponseCache:
+    """In-memory cache of JSON response bodies and their ETags, invalidated by tag"""
+
+    def __init__(self, maxsize: int) -> None:
+        self._entries = EvictingLRUCache(maxsize=maxsize, on_evict=self._unindex)
+        self._keys: defaultdict[str, set[str]] = defaultdict(set)
+        self._generation = 0
+        self._origin = uuid4().hex
+        self._publishing: set[asyncio.Task] = set()
+
+    def _unindex(self, key: str, entry: CachedResponse) -> None:
+        for tag in entry.tags:
+            keys = self._keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[tag]
+
+    def _drop(self, tags: Iterable[str]) -> None:
+        self._generation += 1
+        for tag in tags:
+            for key in self._keys.pop(tag, ()):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._unindex(key, entry)
+
+    def invalidate(self, *tags: str) -> None:
+        """Drops the entries built from any of the tags, in every worker"""
+        self._drop(tags)
+        if not tags:
+            return
+        message = {"origin": self._origin, "tags": list(tags)}
+        task = asyncio.create_task(
+            get_broadcaster().publish(RESPONSE_CACHE_TOPIC, message)
+        )
+        self._publishing.add(task)
+        task.add_done_callback(self._published)
+
+    def _published(self, task: asyncio.Task) -> None:
+        self._publishing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "[ResponseCache.invalidate] Failed to publish invalidation",
+                exc_info=task.exception(),
+            )
+
+    def _on_invalidate(self, message: Message) -> None:
+        if message["origin"] != self._origin:
+            self._drop(message["tags"])
+
+    async def subscribe(self) -> None:
+        """Starts dropping the tags other workers invalidate"""
+        get_broadcaster().subscribe(RESPONSE_CACHE_TOPIC, self._on_invalidate)
+
+    async def unsubscribe(self) -> None:
+        get_broadcaster().unsubscribe(RESPONSE_CACHE_TOPIC, self._on_invalidate)
+
+    async def load(self, key: str, loader: Loader) -> CachedResponse:
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        generation = self._generation
+        loaded = await loader()
+        if loaded is None:
+            raise HTTPException(status_code=404)
+        data, tags = loaded
+        body = orjson.dumps(data)
+        entry = CachedResponse(
+            etag=f'"{blake2b(body, digest_size=16).hexdigest()}"',
+            body=body,
+            tags=tuple(tags),
+        )
+        # A write that landed while loading may not be reflected in the body
+        if generation == self._generation:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._unindex(key, previous)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._keys[tag].add(key)
+        return entry
+
+    async def respond(self, request: Request, key: str, loader: Loader) -> Response:
+        """Answers a GET from the cache, with 304 if the client's copy is current"""
+        entry = await self.load(key, loader)
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("If-None-Match", "")
+        if entry.etag in (etag.strip() for etag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        return Response(
+            content=entry.body, media_type="application/json", headers=headers
+        )
+
+
+response_cache = ResponseCache(maxsize=config.API_CACHE_SIZE)
@@ -0,0 +1,170 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import UUID
+
+import config
+import model
+
+from item_analysis import item_analyzer
+from proctoring import proctor_hub
+from response_cache import exam_tag, response_cache
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+logger = logging.getLogger(__name__)
+
+
+async def complete_exams(exam_ids: list[UUID]) -> None:
+    """Submits the saved answers of the given exams, marks them complete and grades them
+
+    Answers are written as soon as a candidate picks them, so flushing an exam only
+    has to flag its still unsubmitted responses.
+    """
+    if not exam_ids:
+        return
+    async with in_transaction():
+        exam_question_ids = await model.ExamQuestion.filter(
+            exam_id__in=exam_ids
+        ).values_list("id", flat=True)
+        await model.ExamQuestionResponse.filter(
+            exam_question_id__in=exam_question_ids, is_submitted=False
+        ).update(is_submitted=True)
+        await model.Exam.filter(id__in=exam_ids, is_complete=False).update(
+            is_complete=True, completed=timezone.now()
+        )
+    response_cache.invalidate(*map(exam_tag, exam_ids))
+    proctor_hub.exams_completed(exam_ids)
+    await item_analyzer.grade(exam_ids)
+
+
+async def start_exam(exam: model.Exam) -> None:
+    """Starts the exam's clock and schedules its deadline, once
+
+    Two tabs may open the exam at the same time, only the first one sets the start.
+    """
+    if exam.started is not None:
+        return
+    started = timezone.now()
+    deadline = started + timedelta(minutes=exam.time_limit) if exam.time_limit else None
+    if not await model.Exam.filter(id=exam.id, started__isnull=True).update(
+        started=started, deadline=deadline
+    ):
+        await exam.refresh_from_db(fields=["started", "deadline"])
+        return
+    exam.started = started
+    exam.deadline = deadline
+    if deadline is not None:
+        deadline_scheduler.schedule(exam.id, deadline)
+    response_cache.invalidate(exam_tag(exam.id))
+
+
+class DeadlineScheduler:
+    """Server-wide scheduler that auto-submits timed exams when their deadline passes
+
+    Deadlines live in a single heap. Rescheduled or cancelled exams are dropped lazily
+    when their stale heap entry reaches the top, so each tick only pops the deadlines
+    that are due, and the loop sleeps until the earliest one.
+    """
+
+    def __init__(self, batch_size: int) -> None:
+        self.batch_size = batch_size
+        self._heap: list[tuple[datetime, UUID]] = []
+        self._deadlines: dict[UUID, datetime] = {}
+        self._retries: dict[UUID, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, exam_id: UUID, deadline: datetime) -> None:
+        self._deadlines[exam_id] = deadline
+        heapq.heappush(self._heap, (deadline, exam_id))
+        if self._heap[0][1] == exam_id:
+            self._wakeup.set()
+
+    def cancel(self, exam_id: UUID) -> None:
+        self._deadlines.pop(exam_id, None)
+        self._retries.pop(exam_id, None)
+
+    def _pop_due(self, now: datetime) -> list[UUID]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, exam_id = heapq.heappop(self._heap)
+            if self._deadlines.get(exam_id) == deadline:
+                del self._deadlines[exam_id]
+                due.append(exam_id)
+        return due
+
+    def _retry(self, exam_ids: list[UUID]) -> None:
+        """Reschedules exams that failed to complete, backing off exponentially
+
+        Exams that keep failing are dropped until the next restart reloads them, the
+        expired deadline still stops candidates from saving answers meanwhile.
+        """
+        for exam_id in exam_ids:
+            retries = self._retries.get(exam_id, 0) + 1
+            if retries > config.DEADLINE_MAX_RETRIES:
+                logger.error(
+                    f"[DeadlineScheduler._retry] Giving up on completing exam {exam_id}"
+                )
+                self._retries.pop(exam_id, None)
+                continue
+            self._retries[exam_id] = retries
+            delay = config.DEADLINE_RETRY_DELAY * 2 ** (retries - 1)
+            self.schedule(exam_id, timezone.now() + timedelta(seconds=delay))
+
+    async def tick(self) -> None:
+        due = self._pop_due(timezone.now())
+        for i in range(0, len(due), self.batch_size):
+            batch = due[i : i + self.batch_size]
+            try:
+                await complete_exams(batch)
+            except Exception:
+                logger.exception("[DeadlineScheduler.tick] Failed to complete exams")
+                self._retry(batch)
+            else:
+                for exam_id in batch:
+                    self._retries.pop(exam_id, None)
+
+    async def loop(self) -> None:
+        while True:
+            await self.tick()
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(
+                    (self._heap[0][0] - timezone.now()).total_seconds(),
+                    config.DEADLINE_MIN_TICK,
+                )
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except (TimeoutError, asyncio.TimeoutError):
+                pass
+
+    async def load(self) -> None:
+        """Recovers the deadlines of every timed exam still in progress"""
+        for exam_id, deadline in await model.Exam.filter(
+            is_complete=False, deadline__isnull=False
+        ).values_list("id", "deadline"):
+            self._deadlines[exam_id] = deadline
+            self._heap.append((deadline, exam_id))
+        heapq.heapify(self._heap)
+
+    async def start(self) -> None:
+        await self.load()
+        self._task = asyncio.create_task(self.loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+deadline_scheduler = DeadlineScheduler(batch_size=config.DEADLINE_BATCH_SIZE)
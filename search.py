@@ -0,0 +1,208 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import html
+import re
+from dataclasses import dataclass
+from typing import Optional
+from uuid import UUID
+
+from tortoise import Tortoise
+
+# Full-text index over the question bank. Each row holds one ExamTemplateQuestion's id,
+# the plain text of its body and the text of all its responses, and is kept in sync by
+# triggers, so the ORM never has to know about it.
+#
+# FTS5 can only look rows up quickly by rowid, so question_search_key assigns each
+# question a rowid of its own, stable across VACUUM unlike the implicit rowid of
+# examtemplatequestion. Question bodies are HTML from the editor, the triggers index
+# them through strip_html(), a Python function registered on the connection; writes
+# to the question tables from outside the app need it registered too.
+
+QUESTION_SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS question_search_key (
+    id INTEGER PRIMARY KEY,
+    question_id CHAR(36) NOT NULL UNIQUE
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS question_search USING fts5(
+    question_id UNINDEXED, body, responses, tokenize = 'porter unicode61'
+);
+
+CREATE INDEX IF NOT EXISTS examtemplatequestionresponse_question_idx
+    ON examtemplatequestionresponse (exam_template_question_id);
+
+CREATE TRIGGER IF NOT EXISTS question_search_question_insert
+AFTER INSERT ON examtemplatequestion BEGIN
+    INSERT INTO question_search_key (question_id) VALUES (new.id);
+    INSERT INTO question_search (rowid, question_id, body, responses) VALUES (
+        (SELECT id FROM question_search_key WHERE question_id = new.id),
+        new.id,
+        strip_html(new.body),
+        ''
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_search_question_update
+AFTER UPDATE OF body ON examtemplatequestion BEGIN
+    UPDATE question_search SET body = strip_html(new.body) WHERE rowid = (
+        SELECT id FROM question_search_key WHERE question_id = new.id
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_search_question_delete
+AFTER DELETE ON examtemplatequestion BEGIN
+    DELETE FROM question_search WHERE rowid = (
+        SELECT id FROM question_search_key WHERE question_id = old.id
+    );
+    DELETE FROM question_search_key WHERE question_id = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_search_response_insert
+AFTER INSERT ON examtemplatequestionresponse BEGIN
+    UPDATE question_search SET responses = (
+        SELECT coalesce(group_concat(value, ' '), '') FROM examtemplatequestionresponse
+        WHERE exam_template_question_id = new.exam_template_question_id
+    ) WHERE rowid = (
+        SELECT id FROM question_search_key
+        WHERE question_id = new.exam_template_question_id
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_search_response_update
+AFTER UPDATE OF value ON examtemplatequestionresponse BEGIN
+    UPDATE question_search SET responses = (
+        SELECT coalesce(group_concat(value, ' '), '') FROM examtemplatequestionresponse
+        WHERE exam_template_question_id = new.exam_template_question_id
+    ) WHERE rowid = (
+        SELECT id FROM question_search_key
+        WHERE question_id = new.exam_template_question_id
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_search_response_delete
+AFTER DELETE ON examtemplatequestionresponse BEGIN
+    UPDATE question_search SET responses = (
+        SELECT coalesce(group_concat(value, ' '), '') FROM examtemplatequestionresponse
+        WHERE exam_template_question_id = old.exam_template_question_id
+    ) WHERE rowid = (
+        SELECT id FROM question_search_key
+        WHERE question_id = old.exam_template_question_id
+    );
+END;
+"""
+
+# The first version of the index was keyed by the implicit rowid and stored raw HTML
+QUESTION_SEARCH_DROP = """
+DROP TRIGGER IF EXISTS question_search_question_insert;
+DROP TRIGGER IF EXISTS question_search_question_update;
+DROP TRIGGER IF EXISTS question_search_question_delete;
+DROP TRIGGER IF EXISTS question_search_response_insert;
+DROP TRIGGER IF EXISTS question_search_response_update;
+DROP TRIGGER IF EXISTS question_search_response_delete;
+DROP TABLE IF EXISTS question_search;
+"""
+
+QUESTION_SEARCH_REBUILD = """
+DELETE FROM question_search;
+DELETE FROM question_search_key;
+INSERT INTO question_search_key (question_id) SELECT id FROM examtemplatequestion;
+INSERT INTO question_search (rowid, question_id, body, responses)
+SELECT k.id, q.id, strip_html(q.body), coalesce((
+    SELECT group_concat(r.value, ' ') FROM examtemplatequestionresponse r
+    WHERE r.exam_template_question_id = q.id
+), '')
+FROM examtemplatequestion q
+JOIN question_search_key k ON k.question_id = q.id;
+"""
+
+# Matches in the question body weigh twice as much as matches in its responses
+QUESTION_SEARCH_QUERY = """
+SELECT
+    q.id AS question_id,
+    q.body AS body,
+    t.id AS exam_template_id,
+    t.name AS exam_template_name,
+    snippet(question_search, 1, char(2), char(3), '…', 16) AS body_snippet,
+    snippet(question_search, 2, char(2), char(3), '…', 16) AS responses_snippet
+FROM question_search
+JOIN examtemplatequestion q ON q.id = question_search.question_id
+JOIN examtemplate t ON t.id = q.exam_template_id
+WHERE question_search MATCH ?
+ORDER BY bm25(question_search, 0.0, 2.0, 1.0)
+LIMIT ?
+"""
+
+
+@dataclass
+class QuestionSearchResult:
+    question_id: UUID
+    body: str
+    exam_template_id: UUID
+    exam_template_name: str
+    body_snippet: str
+    responses_snippet: str
+
+
+def strip_html(value: Optional[str]) -> Optional[str]:
+    """Plain text of an HTML fragment, as the index stores question bodies"""
+    if value is None:
+        return None
+    return html.unescape(re.sub(r"\s+", " ", re.sub(r"<[^>]*>", " ", value))).strip()
+
+
+def to_highlighted_html(snippet: str) -> str:
+    """Renders a snippet of indexed plain text as HTML with the matched terms in bold"""
+    return html.escape(snippet).replace("\x02", "<b>").replace("\x03", "</b>")
+
+
+def to_match_expression(query: str) -> str:
+    """Turns free text into an FTS5 query matching every word as a prefix"""
+    return " ".join(
+        '"' + term.replace('"', '""') + '"*' for term in query.split() if term
+    )
+
+
+async def create_question_search_index() -> None:
+    connection = Tortoise.get_connection("default")
+    async with connection.acquire_connection() as sqlite_connection:
+        await sqlite_connection.create_function(
+            "strip_html", 1, strip_html, deterministic=True
+        )
+    _, tables = await connection.execute_query(
+        "SELECT name FROM sqlite_master WHERE type = 'table' "
+        "AND name IN ('question_search', 'question_search_key')"
+    )
+    tables = {table["name"] for table in tables}
+    if "question_search" in tables and "question_search_key" not in tables:
+        await connection.execute_script(QUESTION_SEARCH_DROP)
+    await connection.execute_script(QUESTION_SEARCH_SCHEMA)
+    if "question_search_key" not in tables:
+        await rebuild_question_search()
+
+
+async def rebuild_question_search() -> None:
+    await Tortoise.get_connection("default").execute_script(QUESTION_SEARCH_REBUILD)
+
+
+async def search_questions(query: str, limit: int = 20) -> list[QuestionSearchResult]:
+    match = to_match_expression(query)
+    if not match:
+        return []
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        QUESTION_SEARCH_QUERY, [match, limit]
+    )
+    return [
+        QuestionSearchResult(
+            question_id=UUID(str(row["question_id"])),
+            body=row["body"],
+            exam_template_id=UUID(str(row["exam_template_id"])),
+            exam_template_name=row["exam_template_name"],
+            body_snippet=to_highlighted_html(row["body_snippet"]),
+            responses_snippet=to_highlighted_html(row["responses_snippet"]),
+        )
+        for row in rows
+    ]
@@ -4,9 +4,50 @@ Copyright 2024, Kansas Fiber Network, LLC
 :author: Zach Puls <zpuls@ksfiber.net>
 """
 
+from tortoise import models
+
+
+class ConcurrentModificationError(Exception):
+    """Raised when a row was changed by someone else since it was loaded"""
+
 
 class Serializable:
-    """Helper class for objects being persisted to/from a database"""
+    """Helper class for objects being persisted to/from a database
+
+    Subclasses list the columns they write in values(). The last persisted values are
+    kept so save() can skip writes that change nothing, and so a change from another
+    editor is not applied over a field with unsaved local edits.
+    """
+
+    def __post_init__(self) -> None:
+        self.mark_saved()
+
+    def values(self) -> dict[str, any]:
+        return {}
+
+    def mark_saved(self) -> None:
+        self._saved = self.values()
+
+    def is_dirty(self) -> bool:
+        return self.values() != self._saved
+
+    def apply_values(self, version: int, values: dict[str, any]) -> bool:
+        """Takes values saved elsewhere, keeping fields with unsaved local changes
+
+        Returns whether any local change was kept over a different saved value.
+        """
+        local = self.values()
+        kept = {
+            name
+            for name, value in values.items()
+            if local[name] != self._saved[name] and local[name] != value
+        }
+        for name, value in values.items():
+            if name not in kept:
+                setattr(self, name, value)
+        self._saved = dict(values)
+        self.version = version
+        return bool(kept)
 
     async def new(self) -> None:
         pass
@@ -17,3 +58,20 @@ class Serializable:
     @staticmethod
     async def load(from_value: any) -> any:
         pass
+
+
+async def save_versioned(
+    model_class: type[models.Model], id: any, version: int, **values
+) -> int:
+    """Writes values to the row only if it is still at the given version
+
+    Returns the row's new version, raises ConcurrentModificationError if it was stale.
+    """
+    updated = await model_class.filter(id=id, version=version).update(
+        version=version + 1, **values
+    )
+    if not updated:
+        raise ConcurrentModificationError(
+            f"[save_versioned] {model_class.__name__} {id} is not at version {version}"
+        )
+    return version + 1
@@ -0,0 +1,111 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+from datetime import timedelta
+
+import model
+
+from archive import exam_results, ExamArchiver, rehydrate_exam
+from tortoise import Tortoise, timezone
+
+
+def test_archive_round_trip():
+    async def run() -> dict:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            user = await model.User.create(name="Alice", email="alice@test")
+            exam_template = await model.ExamTemplate.create(
+                name="MPLS", author=user, updated_by=user
+            )
+            template_question = await model.ExamTemplateQuestion.create(
+                exam_template=exam_template, type=1, body="What does LDP do?"
+            )
+            kept = await model.ExamTemplateQuestionResponse.create(
+                exam_template_question=template_question,
+                value="Labels",
+                is_correct=True,
+            )
+            removed = await model.ExamTemplateQuestionResponse.create(
+                exam_template_question=template_question,
+                value="Routes",
+                is_correct=False,
+            )
+
+            completed = timezone.now() - timedelta(days=400)
+            # Grading failed for the old exam, it is archived all the same
+            old = await model.Exam.create(
+                user=user, name="MPLS", is_complete=True, completed=completed
+            )
+            recent = await model.Exam.create(
+                user=user,
+                name="MPLS",
+                is_complete=True,
+                completed=timezone.now(),
+                score=1.0,
+            )
+            question = await model.ExamQuestion.create(
+                exam=old,
+                type=1,
+                body="What does LDP do?",
+                exam_template_question=template_question,
+            )
+            for response in (kept, removed):
+                await model.ExamQuestionResponse.create(
+                    exam_question=question,
+                    exam_template_question_response=response,
+                    is_submitted=True,
+                )
+            await model.ExamQuestionResponse.all().update(submitted_datetime=completed)
+            before = await model.ExamQuestionResponse.all().order_by("id").values()
+
+            archived = await ExamArchiver(
+                retention=timedelta(days=365), batch_size=1, interval=0
+            ).run()
+            results = await exam_results(user.id)
+            live_questions = await model.ExamQuestion.all().count()
+
+            await removed.delete()
+            rehydrated = await rehydrate_exam(old.id)
+            after = await model.ExamQuestionResponse.all().order_by("id").values()
+            return {
+                "archived": archived,
+                "results": [(r.id, r.score, r.is_archived) for r in results],
+                "live_questions": live_questions,
+                "rehydrated": rehydrated,
+                "before": before,
+                "after": after,
+                "question": await model.ExamQuestion.get(id=question.id),
+                "old": old,
+                "recent": recent,
+                "kept": kept,
+                "num_archived": await model.ArchivedExam.all().count(),
+            }
+        finally:
+            await Tortoise.close_connections()
+
+    result = asyncio.run(run())
+    old, recent = result["old"], result["recent"]
+    assert result["archived"] == 1
+    assert result["results"] == [(recent.id, 1.0, False), (old.id, None, True)]
+    assert result["live_questions"] == 0
+
+    rehydrated = result["rehydrated"]
+    assert (rehydrated.id, rehydrated.is_complete, rehydrated.score) == (
+        old.id,
+        True,
+        None,
+    )
+    assert result["question"].exam_template_question_id is not None
+    assert result["num_archived"] == 0
+    # Answers come back unchanged, except the one whose template response is gone
+    kept = result["kept"]
+    for before, after in zip(result["before"], result["after"], strict=True):
+        if before["exam_template_question_response_id"] == kept.id:
+            assert after == before
+        else:
+            assert after == before | {"exam_template_question_response_id": None}
@@ -0,0 +1,94 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+
+import httpx
+import model
+
+from directory_sync import DirectorySync
+from tortoise import Tortoise
+
+ENDPOINT = "http://graph.test/v1.0/users"
+
+
+def stub_graph(pages: dict[str, dict]) -> httpx.AsyncClient:
+    """A Graph server answering each known URL with its delta page"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["Authorization"] == "Bearer token"
+        page = pages.get(str(request.url))
+        if page is None:
+            return httpx.Response(404)
+        return httpx.Response(200, json=page)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def token() -> str:
+    return "token"
+
+
+def run(pages: dict[str, dict], runs: int = 1) -> list[tuple]:
+    async def sync() -> list[tuple]:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            directory_sync = DirectorySync(
+                ENDPOINT,
+                token,
+                batch_size=10,
+                interval=0,
+                http_client=stub_graph(pages),
+            )
+            for _ in range(runs):
+                await directory_sync.run()
+            return (
+                await model.User.all()
+                .order_by("object_id")
+                .values_list("object_id", "name", "email", "is_active")
+            )
+        finally:
+            await Tortoise.close_connections()
+
+    return asyncio.run(sync())
+
+
+def test_repeated_object_in_one_page_is_merged():
+    pages = {
+        f"{ENDPOINT}/delta?$select=id,displayName,mail,userPrincipalName": {
+            "value": [
+                {"id": "a", "displayName": "Alice", "userPrincipalName": "alice@test"},
+                {"id": "a", "displayName": "Alice Smith"},
+            ],
+            "@odata.deltaLink": f"{ENDPOINT}/delta?$deltatoken=1",
+        },
+    }
+    assert run(pages) == [("a", "Alice Smith", "alice@test", True)]
+
+
+def test_delta_link_resumes_and_removes_users():
+    pages = {
+        f"{ENDPOINT}/delta?$select=id,displayName,mail,userPrincipalName": {
+            "value": [
+                {"id": "a", "displayName": "Alice", "userPrincipalName": "alice@test"},
+                {"id": "b", "displayName": "Bob", "mail": "bob@test"},
+            ],
+            "@odata.deltaLink": f"{ENDPOINT}/delta?$deltatoken=1",
+        },
+        f"{ENDPOINT}/delta?$deltatoken=1": {
+            "value": [{"id": "b", "@removed": {"reason": "deleted"}}],
+            "@odata.deltaLink": f"{ENDPOINT}/delta?$deltatoken=2",
+        },
+        f"{ENDPOINT}/delta?$deltatoken=2": {
+            "value": [],
+            "@odata.deltaLink": f"{ENDPOINT}/delta?$deltatoken=2",
+        },
+    }
+    assert run(pages, runs=3) == [
+        ("a", "Alice", "alice@test", True),
+        ("b", "Bob", "bob@test", False),
+    ]
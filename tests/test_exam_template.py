@@ -0,0 +1,183 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+from uuid import uuid4
+
+import config
+import model
+import orjson
+
+from admin.exam_template import (
+    ExamTemplate,
+    ExamTemplateQuestion,
+    ExamTemplateQuestionResponse,
+)
+from nicegui import Client
+from nicegui.page import page
+from tortoise import Tortoise
+
+
+def pending_update_size(client: Client) -> int:
+    """Size of the update message the outbox would emit for the queued elements"""
+    return len(
+        orjson.dumps(
+            {
+                element_id: None if element is None else element._to_dict()
+                for element_id, element in client.outbox.updates.items()
+            },
+            default=str,
+            option=orjson.OPT_NON_STR_KEYS,
+        )
+    )
+
+
+def test_edits_stay_under_the_payload_limit():
+    async def edit() -> dict[str, int]:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            user = await model.User.create(name="Author", email="author@test")
+            exam_template = await model.ExamTemplate.create(
+                name="MPLS", author=user, updated_by=user
+            )
+            question = await model.ExamTemplateQuestion.create(
+                exam_template=exam_template, type=1, body="<p>What does LDP do?</p>"
+            )
+            for i in range(20):
+                await model.ExamTemplateQuestionResponse.create(
+                    exam_template_question=question,
+                    value=f"Answer {i}",
+                    is_correct=False,
+                )
+            await question.fetch_related("exam_template", "responses")
+            editor = await ExamTemplateQuestion.load(question)
+
+            # The outbox loop only runs once the app has started, so every update an
+            # edit queues stays in client.outbox.updates
+            client = Client(page("/"), request=None)
+            sizes = {}
+            with client, client.content:
+                await editor.edit()
+                sizes["edit"] = pending_update_size(client)
+
+                client.outbox.updates.clear()
+                await editor.toggle_response_correct(editor.responses[0])
+                sizes["toggle"] = pending_update_size(client)
+
+                client.outbox.updates.clear()
+                await editor.add_response(
+                    ExamTemplateQuestionResponse(
+                        id=None,
+                        exam_template_question_id=editor.id,
+                        value="Labels",
+                        is_correct=False,
+                    )
+                )
+                sizes["add"] = pending_update_size(client)
+
+                client.outbox.updates.clear()
+                await editor.delete_response(editor.responses[1])
+                sizes["delete"] = pending_update_size(client)
+            return sizes
+        finally:
+            await Tortoise.close_connections()
+
+    sizes = asyncio.run(edit())
+    for name in ("toggle", "add", "delete"):
+        assert 0 < sizes[name] <= config.EDIT_PAYLOAD_LIMIT_BYTES, sizes
+    # Rebuilding the question would cost far more than any single edit
+    assert sizes["edit"] > config.EDIT_PAYLOAD_LIMIT_BYTES, sizes
+
+
+def test_noop_saves_are_skipped_and_unsaved_fields_are_kept():
+    async def edit() -> tuple:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            user = await model.User.create(name="Author", email="author@test")
+            exam_template = await model.ExamTemplate.create(
+                name="MPLS", author=user, updated_by=user
+            )
+            question = await model.ExamTemplateQuestion.create(
+                exam_template=exam_template, type=1, body="<p>What does LDP do?</p>"
+            )
+            response = await model.ExamTemplateQuestionResponse.create(
+                exam_template_question=question, value="Labels", is_correct=False
+            )
+            editor = await ExamTemplateQuestionResponse.load(response)
+            editor.exam_template_id = exam_template.id
+
+            await editor.save()
+            unchanged_version = (await model.ExamTemplateQuestionResponse.get()).version
+
+            # Another editor's change arrives while this one is typing
+            editor.value = "Distributes labels"
+            client = Client(page("/"), request=None)
+            with client:
+                editor.apply(
+                    {
+                        "entity": "response",
+                        "op": "update",
+                        "id": str(editor.id),
+                        "version": 2,
+                        "fields": {
+                            "exam_template_question_id": str(question.id),
+                            "value": "Swaps labels",
+                            "is_correct": True,
+                        },
+                    }
+                )
+            return unchanged_version, editor.value, editor.is_correct, editor.version
+        finally:
+            await Tortoise.close_connections()
+
+    unchanged_version, value, is_correct, version = asyncio.run(edit())
+    assert unchanged_version == 1
+    assert (value, is_correct, version) == ("Distributes labels", True, 2)
+
+
+def test_changes_apply_after_a_broker_round_trip():
+    question_id, response_id = uuid4(), uuid4()
+    editor = ExamTemplate(
+        id=uuid4(),
+        name="MPLS",
+        questions=[
+            ExamTemplateQuestion(
+                id=question_id,
+                exam_template_id=None,
+                type=model.QuestionType.MULTIPLE_CHOICE_SINGLE_SELECT,
+                body="<p>What does LDP do?</p>",
+                responses=[
+                    ExamTemplateQuestionResponse(
+                        id=response_id,
+                        exam_template_question_id=question_id,
+                        value="Labels",
+                        is_correct=False,
+                    )
+                ],
+            )
+        ],
+    )
+    message = {
+        "entity": "response",
+        "op": "update",
+        "id": str(response_id),
+        "version": 2,
+        "fields": {
+            "exam_template_question_id": str(question_id),
+            "value": "Distributes labels",
+            "is_correct": True,
+        },
+    }
+    # A broker-backed broadcaster hands subscribers what came back out of JSON
+    asyncio.run(editor.apply_change(orjson.loads(orjson.dumps(message))))
+    response = editor.questions[0].responses[0]
+    assert (response.value, response.is_correct, response.version) == (
+        "Distributes labels",
+        True,
+        2,
+    )
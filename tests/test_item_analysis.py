@@ -0,0 +1,75 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import math
+from uuid import uuid4
+
+from admin.exam_template import publish_change
+from item_analysis import item_analyzer, ItemStatistics
+
+Q1, Q2 = uuid4(), uuid4()
+A, B, C, D = uuid4(), uuid4(), uuid4(), uuid4()
+RESPONSES = [(A, Q1, True), (B, Q1, False), (C, Q2, True), (D, Q2, False)]
+EXAMS = [uuid4() for _ in range(5)]
+# Selections per exam, the last candidate picked both responses to Q1
+SELECTED = [[A, C], [A, D], [B, C], [B, D], [A, B, C]]
+
+
+def attempts(exams: range) -> tuple[list, list, list]:
+    question_rows = []
+    selection_rows = []
+    for i in exams:
+        rows = {Q1: uuid4(), Q2: uuid4()}
+        question_rows += [(id, EXAMS[i], question) for question, id in rows.items()]
+        selection_rows += [
+            (rows[Q1 if response in (A, B) else Q2], response)
+            for response in SELECTED[i]
+        ]
+    return question_rows, selection_rows, RESPONSES
+
+
+def check(statistics: ItemStatistics) -> None:
+    # Q1: x = 1 1 0 0 0, Q2: x = 1 0 1 0 1, y = 1 .5 .5 0 .5
+    # r = (nΣxy - ΣxΣy) / √((nΣx - (Σx)²)(nΣy² - (Σy)²)) = 2.5 / √15 for both
+    q1 = statistics.question(Q1)
+    q2 = statistics.question(Q2)
+    assert q1.num_attempts == q2.num_attempts == 5
+    assert math.isclose(q1.difficulty, 0.4)
+    assert math.isclose(q2.difficulty, 0.6)
+    assert math.isclose(q1.discrimination, 2.5 / math.sqrt(15))
+    assert math.isclose(q2.discrimination, 2.5 / math.sqrt(15))
+    assert q1.selection_rates == {A: 0.6, B: 0.6}
+    assert q2.selection_rates == {C: 0.6, D: 0.4}
+
+
+def test_statistics_match_hand_computed_values():
+    statistics = ItemStatistics()
+    scores = statistics.add(*attempts(range(5)))
+    assert scores == dict(zip(EXAMS, [1.0, 0.5, 0.5, 0.0, 0.5]))
+    check(statistics)
+
+
+def test_statistics_fold_in_batches_and_skip_repeats():
+    statistics = ItemStatistics()
+    statistics.add(*attempts(range(3)))
+    statistics.add(*attempts(range(3, 5)))
+    # An exam already counted, e.g. graded again by a scan, is ignored
+    assert statistics.add(*attempts(range(2))) == {}
+    check(statistics)
+
+
+def test_template_edits_drop_cached_statistics():
+    exam_template_id = uuid4()
+    item_analyzer._statistics[exam_template_id] = ItemStatistics()
+    asyncio.run(
+        publish_change(exam_template_id, "question", "update", uuid4(), 2, body="")
+    )
+    assert exam_template_id in item_analyzer._statistics
+    asyncio.run(
+        publish_change(exam_template_id, "response", "update", uuid4(), 2, value="")
+    )
+    assert exam_template_id not in item_analyzer._statistics
@@ -0,0 +1,95 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+
+import model
+import pytest
+
+from migrations import migrate_schema
+from tortoise import Tortoise
+from tortoise.exceptions import IntegrityError
+
+# Tables as the first release created them
+OLD_SCHEMA = """
+CREATE TABLE "user" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "name" TEXT NOT NULL,
+    "email" TEXT NOT NULL
+);
+CREATE TABLE "exam" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "name" TEXT NOT NULL,
+    "is_complete" INT NOT NULL,
+    "user_id" CHAR(36) NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "examquestion" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "type" SMALLINT NOT NULL,
+    "body" TEXT NOT NULL,
+    "exam_id" CHAR(36) NOT NULL REFERENCES "exam" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "examquestionresponse" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "submitted_datetime" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "is_submitted" INT NOT NULL,
+    "exam_question_id" CHAR(36) NOT NULL REFERENCES "examquestion" ("id")
+        ON DELETE CASCADE
+);
+CREATE TABLE "examtemplate" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "name" TEXT NOT NULL,
+    "created" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updated" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "author_id" CHAR(36) NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    "updated_by_id" CHAR(36) NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "examtemplatequestion" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "type" SMALLINT NOT NULL,
+    "body" TEXT NOT NULL,
+    "exam_template_id" CHAR(36) NOT NULL REFERENCES "examtemplate" ("id")
+        ON DELETE CASCADE
+);
+CREATE TABLE "examtemplatequestionresponse" (
+    "id" CHAR(36) NOT NULL PRIMARY KEY,
+    "value" TEXT NOT NULL,
+    "is_correct" INT NOT NULL,
+    "exam_template_question_id" CHAR(36) NOT NULL
+        REFERENCES "examtemplatequestion" ("id") ON DELETE CASCADE
+);
+INSERT INTO "user" VALUES ('4f8e0f1a-7d5e-4a51-9b55-3c0c8a7f2f10', 'Alice', 'a@test');
+INSERT INTO "exam" VALUES (
+    '0b6f0b57-8f4e-4d43-9d7e-2f4d9e1f8a22', 'MPLS', 1,
+    '4f8e0f1a-7d5e-4a51-9b55-3c0c8a7f2f10'
+);
+"""
+
+
+def test_old_tables_gain_the_new_columns():
+    async def migrate() -> tuple:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        try:
+            await Tortoise.get_connection("default").execute_script(OLD_SCHEMA)
+            await migrate_schema()
+            # Running again on the migrated tables changes nothing
+            await migrate_schema()
+            await Tortoise.generate_schemas()
+
+            user = await model.User.get()
+            exam = await model.Exam.get()
+            await model.User.filter(id=user.id).update(object_id="a")
+            await model.ExamTemplate.create(
+                name="MPLS", author=user, updated_by=user, time_limit=30
+            )
+            template = await model.ExamTemplate.get()
+            with pytest.raises(IntegrityError):
+                await model.User.create(name="Bob", email="b@test", object_id="a")
+            return user.is_active, exam.deadline, exam.score, template.version
+        finally:
+            await Tortoise.close_connections()
+
+    assert asyncio.run(migrate()) == (True, None, None, 1)
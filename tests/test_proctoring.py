@@ -0,0 +1,86 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+import time
+
+import model
+
+from broadcast import get_broadcaster, Message
+from proctoring import PROCTOR_TOPIC, ProctorHub
+from tortoise import Tortoise
+
+NUM_CANDIDATES = 500
+NUM_QUESTIONS = 20
+
+
+async def seed() -> list[model.Exam]:
+    users = [
+        model.User(name=f"Candidate {i}", email=f"candidate{i}@test")
+        for i in range(NUM_CANDIDATES)
+    ]
+    await model.User.bulk_create(users)
+    exams = [
+        model.Exam(user_id=user.id, name="MPLS", is_complete=False, time_limit=60)
+        for user in users
+    ]
+    await model.Exam.bulk_create(exams)
+    await model.ExamQuestion.bulk_create(
+        [
+            model.ExamQuestion(exam_id=exam.id, type=1, body=f"Question {i}")
+            for exam in exams
+            for i in range(NUM_QUESTIONS)
+        ]
+    )
+    return await model.Exam.all().prefetch_related("user", "questions")
+
+
+def test_hub_pushes_each_changed_exam_once_per_interval():
+    async def drive() -> tuple[list[list[Message]], float]:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        pushes: list[list[Message]] = []
+
+        def on_push(message: Message) -> None:
+            pushes.append(message["activities"])
+
+        get_broadcaster().subscribe(PROCTOR_TOPIC, on_push)
+        try:
+            exams = await seed()
+            hub = ProctorHub(push_interval=1.0)
+            await hub.load()
+
+            # Every candidate answers every question between two pushes
+            started = time.perf_counter()
+            for exam in exams:
+                for number, question in enumerate(exam.questions, start=1):
+                    hub.question_viewed(exam, number)
+                    hub.answer_saved(exam, question.id, True)
+            await hub.push()
+            elapsed = time.perf_counter() - started
+
+            # Nothing changed since, so nothing is pushed
+            await hub.push()
+            hub.exams_completed([exam.id for exam in exams[:100]])
+            await hub.push()
+            # Completed exams were pushed one last time and then dropped
+            hub.exams_completed([exam.id for exam in exams[:100]])
+            await hub.push()
+            return pushes, elapsed
+        finally:
+            get_broadcaster().unsubscribe(PROCTOR_TOPIC, on_push)
+            await Tortoise.close_connections()
+
+    pushes, elapsed = asyncio.run(drive())
+    assert [len(activities) for activities in pushes] == [NUM_CANDIDATES, 100]
+    assert all(
+        activity["num_answered"] == NUM_QUESTIONS
+        and activity["current_question"] == NUM_QUESTIONS
+        for activity in pushes[0]
+    )
+    assert all(activity["is_complete"] for activity in pushes[1])
+    # 10,000 events and one push are in-memory work, nowhere near a push interval
+    assert elapsed < 1.0, f"{NUM_CANDIDATES} candidates took {elapsed:.3f}s"
@@ -0,0 +1,45 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+
+from response_cache import ResponseCache
+
+
+def test_invalidation_reaches_the_other_workers():
+    async def run() -> tuple[int, int]:
+        # Two workers, each with its own cache, sharing the broadcaster
+        workers = [ResponseCache(maxsize=8), ResponseCache(maxsize=8)]
+        loads = [0, 0]
+
+        def loader(i: int):
+            async def load() -> tuple[dict, list[str]]:
+                loads[i] += 1
+                return {"loads": loads[i]}, ["exam:1"]
+
+            return load
+
+        for worker in workers:
+            await worker.subscribe()
+        try:
+            for i, worker in enumerate(workers):
+                await worker.load("exam", loader(i))
+            workers[0].invalidate("exam:1")
+            # Let the published invalidation reach the subscribers
+            await asyncio.sleep(0)
+            for i, worker in enumerate(workers):
+                await worker.load("exam", loader(i))
+            # Invalidating a tag nothing was built from leaves the entries alone
+            workers[1].invalidate("exam:2")
+            await asyncio.sleep(0)
+            for i, worker in enumerate(workers):
+                await worker.load("exam", loader(i))
+        finally:
+            for worker in workers:
+                await worker.unsubscribe()
+        return tuple(loads)
+
+    assert asyncio.run(run()) == (2, 2)
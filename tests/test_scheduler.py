@@ -0,0 +1,39 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+from datetime import timedelta
+
+import model
+
+from scheduler import deadline_scheduler, start_exam
+from tortoise import Tortoise
+
+
+def test_exam_clock_starts_once():
+    async def start() -> tuple:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            user = await model.User.create(name="Alice", email="alice@test")
+            exam = await model.Exam.create(
+                user=user, name="MPLS", is_complete=False, time_limit=30
+            )
+            # Two tabs loaded the exam before either started it
+            first = await model.Exam.get(id=exam.id)
+            second = await model.Exam.get(id=exam.id)
+            await start_exam(first)
+            await start_exam(second)
+            saved = await model.Exam.get(id=exam.id)
+            scheduled = deadline_scheduler._deadlines.get(exam.id)
+            deadline_scheduler.cancel(exam.id)
+            return first, second, saved, scheduled
+        finally:
+            await Tortoise.close_connections()
+
+    first, second, saved, scheduled = asyncio.run(start())
+    assert saved.deadline - saved.started == timedelta(minutes=30)
+    assert first.deadline == second.deadline == saved.deadline == scheduled
@@ -0,0 +1,65 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+
+import model
+
+from search import create_question_search_index, search_questions
+from tortoise import Tortoise
+
+
+def test_index_follows_question_and_response_changes():
+    async def search() -> dict[str, list]:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            user = await model.User.create(name="Author", email="author@test")
+            exam_template = await model.ExamTemplate.create(
+                name="MPLS", author=user, updated_by=user
+            )
+            # Created before the index exists, picked up by the initial rebuild
+            ospf = await model.ExamTemplateQuestion.create(
+                exam_template=exam_template, type=1, body="<p>OSPF areas</p>"
+            )
+            await create_question_search_index()
+            ldp = await model.ExamTemplateQuestion.create(
+                exam_template=exam_template,
+                type=1,
+                body="<p>Does LDP distribute <b>labels</b> &amp; FECs?</p>",
+            )
+            response = await model.ExamTemplateQuestionResponse.create(
+                exam_template_question=ospf, value="Labels & areas", is_correct=False
+            )
+
+            results = {"ranked": await search_questions("label")}
+            # Markup and entities are not indexed as words
+            results["markup"] = await search_questions("amp")
+            ldp.body = "<p>What does LDP do?</p>"
+            await ldp.save()
+            response.value = "Backbone"
+            await response.save()
+            results["updated"] = await search_questions("label")
+            results["backbone"] = await search_questions("backbone")
+            await response.delete()
+            await ospf.delete()
+            results["deleted"] = await search_questions("areas")
+            results["ldp"] = await search_questions("ldp")
+            return results
+        finally:
+            await Tortoise.close_connections()
+
+    results = asyncio.run(search())
+    ldp, ospf = results["ranked"]
+    # Matches in the body rank above matches in the responses
+    assert ldp.body_snippet == "Does LDP distribute <b>labels</b> &amp; FECs?"
+    assert ospf.body_snippet == "OSPF areas"
+    assert ospf.responses_snippet == "<b>Labels</b> &amp; areas"
+    assert results["markup"] == []
+    assert results["updated"] == []
+    assert [r.question_id for r in results["backbone"]] == [ospf.question_id]
+    assert results["deleted"] == []
+    assert [r.question_id for r in results["ldp"]] == [ldp.question_id]
@@ -0,0 +1,48 @@
+"""
+Copyright 2024, Kansas Fiber Network, LLC
+
+:author: Zach Puls <zpuls@ksfiber.net>
+"""
+
+import asyncio
+
+import model
+
+from tortoise import Tortoise
+from user import sign_in
+
+
+def claims(oid: str, name: str, email: str) -> dict:
+    return {"oid": oid, "name": name, "preferred_username": email}
+
+
+def test_sign_in_goes_by_object_id():
+    async def run() -> tuple:
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"model": ["model"]})
+        await Tortoise.generate_schemas()
+        try:
+            # Two people who share a name and, once, an address
+            await model.User.create(name="Alex", email="alex@test", object_id="a")
+            unlinked = await model.User.create(name="Alex", email="alex2@test")
+            await model.User.create(
+                name="Sam", email="sam@test", object_id="s", is_active=False
+            )
+
+            signed_in = [
+                await sign_in(claims("a", "Alex", "alex2@test")),
+                await sign_in(claims("b", "Alex", "alex2@test")),
+                await sign_in(claims("c", "Casey", "casey@test")),
+                await sign_in(claims("c", "Casey", "casey@test")),
+                await sign_in(claims("s", "Sam", "sam@test")),
+            ]
+            return signed_in, unlinked, await model.User.all().count()
+        finally:
+            await Tortoise.close_connections()
+
+    (alex, alex2, casey, casey_again, sam), unlinked, num_users = asyncio.run(run())
+    assert (alex.object_id, alex.email) == ("a", "alex@test")
+    # The user added by hand is linked by email on first sign-in
+    assert (alex2.id, alex2.object_id) == (unlinked.id, "b")
+    assert casey.id == casey_again.id
+    assert sam is None
+    assert num_users == 4
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 from uuid import UUID
 
 import model
@@ -24,6 +25,29 @@ class User(Serializable):
 
     @staticmethod
     async def get_active() -> any:
-        name = app.storage.user["user"]["name"]
-        email = app.storage.user["user"]["preferred_username"]
-        return await model.User.get(name=name, email=email)
+        # Names and emails are not unique, the directory object id is
+        object_id = app.storage.user["user"]["oid"]
+        return await model.User.get(object_id=object_id, is_active=True)
+
+
+async def sign_in(claims: dict) -> Optional[model.User]:
+    """Finds or creates the user of the ID token claims, None if they are deactivated"""
+    object_id = claims["oid"]
+    user = await model.User.get_or_none(object_id=object_id)
+    if user is None:
+        # Users added before the directory sync or by hand only have their email
+        user = await model.User.filter(
+            object_id__isnull=True, email=claims["preferred_username"]
+        ).first()
+        if user is not None:
+            user.object_id = object_id
+            await user.save(update_fields=["object_id"])
+        else:
+            user, _ = await model.User.get_or_create(
+                object_id=object_id,
+                defaults={
+                    "name": claims["name"],
+                    "email": claims["preferred_username"],
+                },
+            )
+    return user if user.is_active else None